@@ -16,124 +16,94 @@ Solution:
     could use information from these videos to create a system that can best
     identify a music video.
 
+    More playlists (e.g. one per genre) can be added to playlist_ids to widen the
+    reference set. They are fetched concurrently and cached (see
+    module_reference_corpus.py), so rerunning the script is nearly free.
+
 '''
 
 import os
-import string
-from collections import Counter
-import pandas as pd
-import pickle
+import sys
 from nltk.corpus import stopwords
 from googleapiclient.discovery import build
 
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../1. modules/'))
+from module_video_details_cache import VideoDetailsCache
+from module_reference_corpus import ReferenceCorpusBuilder
+from module_vocabulary_stats import VocabularyStats
+
 # If you have never downloaded list of stopwords before, uncomment the following lines:
 # import nltk
 # nltk.download('stopwords')
 
-# Opening the API key.
 base_path = os.path.dirname(__file__)
-with open(os.path.join(base_path, '../_private_data/api_key.txt'), 'r', encoding='utf-8') as f:
-    api_key = f.read()
-    
-# Creating a YouTube resource
-yt = build('youtube', 'v3', developerKey=api_key)
 
 ####################################################
 
-# Variable to keep track of pages from the playlist.
-nextPageToken = None
-
-# List to store the video details from the playlist
-all_video_details = []
-
-playlist_id = 'PLhsz9CILh357zA1yMT-K5T9ZTNEU6Fl6n'
-# What's the idea, here?
-# We loop through each page of the playlist, fetch the video ID of all present
-# videos, fetch the details of those videos and append them to a list. Repeat
-# the process, until the playlist pages are exhausted.
-while True:
-    # YouTube resource to fetch playlist video IDs.
-    pl_req = yt.playlistItems().list(
-        part='contentDetails',
-        playlistId=playlist_id,
-        maxResults=50,
-        pageToken=nextPageToken
-        )
-    pl_response = pl_req.execute()
-
-    # Fetching the video ID's of 50 (maximum allowed) videos.
-    video_ids = []
-    for item in pl_response['items']:
-        video_ids.append(item['contentDetails'].get('videoId'))
-
-    # YouTube resource to fetch details of the obtained 50 videos.
-    # snippet contains Title, Tags, Description and CategoryID.
-    vid_req = yt.videos().list(
-        part='snippet',
-        id=','.join(video_ids)
-        )
-    vid_response = vid_req.execute()
-
-    # Adding the necessary information to a dictionary and appending
-    # to a list for all the playlist videos.
-    for details, yt_id in zip(vid_response["items"], video_ids):
-        snippet = details["snippet"]
-        # Fetching the necessary details from the snippet key
-        every_video_detail = dict(
-            VideoID=yt_id,
-            Title=snippet.get("title"),
-            CategoryID=snippet.get("categoryId"),
-            PublishDate=snippet.get("publishedAt"),
-            ChannelTitle=snippet.get("channelTitle"),
-            Description=snippet.get("description"),
-            Tags=snippet.get("tags"),
-        )
-        all_video_details.append(every_video_detail)
-
-    # Returns None if we have exhausted all pages. Break if it returns None.
-    # not None returns True.
-    nextPageToken = pl_response.get('nextPageToken')
-    if not nextPageToken:
-        break
-
-df = pd.DataFrame(all_video_details)
+# Playlists of ONLY MUSIC videos.
+playlist_ids = [
+    'PLhsz9CILh357zA1yMT-K5T9ZTNEU6Fl6n',
+    ]
+
+# Number of top categories, tags and description words kept in the model.
+n_categories = 2
+n_tags = 750
+n_desc_words = 250
+
+# The counts of every video fetched so far are kept in vocabulary_stats.json (see
+# module_vocabulary_stats.py). Run with --from-stats to only change the cutoffs above,
+# without fetching anything.
+stats_path = os.path.join(base_path, 'music_identify_data/vocabulary_stats.json')
+stats = VocabularyStats.load(stats_path, stopwords.words('english'))
+
+if '--from-stats' not in sys.argv[1:]:
+    # Opening the API key, only needed to fetch the playlists.
+    with open(os.path.join(base_path, '../_private_data/api_key.txt'), 'r', encoding='utf-8') as f:
+        api_key = f.read()
+
+    # Creating a YouTube resource
+    yt = build('youtube', 'v3', developerKey=api_key)
+
+    # What's the idea, here?
+    # We page through every playlist, fetching the details of the videos of every page
+    # as soon as it arrives. Playlist items and video details are cached, so only what
+    # hasn't been fetched before costs quota.
+    with VideoDetailsCache(os.path.join(base_path, '../_private_data/VideoDetailsCache.sqlite')) as cache:
+        builder = ReferenceCorpusBuilder(yt, playlist_ids, cache=cache, max_workers=8, requests_per_sec=20)
+        df = builder.build()
+    if not builder.complete:
+        print("The API quota ran out, the vocabularies are built from the videos fetched so far...")
+    print(f"Fetched the details of {len(df)} videos from {len(builder.playlist_ids)} playlists...")
+
+    # Only the videos of the new playlists are counted.
+    n_added = stats.add_videos(df)
+    stats.save(stats_path)
+    print(f"Counted {n_added} new videos, {len(stats)} in total...")
+
+if not len(stats):
+    print(f"No videos have been counted in {stats_path} yet, the model can't be built.")
+    if '--from-stats' in sys.argv[1:]:
+        print("Run the script without --from-stats first, to fetch the playlists.")
+    sys.exit(1)
 
 ######################################
 
 # 1. Filtering most used CategoryID
-# Filtering the top 2 CategoryIDs which YT identifies as music.
-top_categories = df['CategoryID'].value_counts()[:2]
-print(f"Fetched top-2 categories that account for {round(sum(top_categories)/len(df)*100, 2)} % music videos...")
+# Filtering the top CategoryIDs which YT identifies as music.
+top_categories = stats.top('categories', n_categories)
+print(f"Fetched top-{n_categories} categories that account for {round(sum(count for _, count in top_categories)/len(stats)*100, 2)} % music videos...")
 
 # 2. Filtering most used Tags
-# The tags column contains a list of tags associated with each video.
-# Creating a single list of all the tags associated with the videos.
-all_tags = [
-    tag.lower() for tags in df['Tags'].tolist() if tags is not None for tag in tags
-    ]
-# Fetching the top 1000 most common tags in music videos.
-top_tags = Counter(all_tags).most_common(750)
-print(f"Fetched {len(top_tags)} most common tags...")
+# Every tag is counted once per video it's used in, in lower case.
+print(f"Fetched {len(stats.top('tags', n_tags))} most common tags...")
 
 # 3. Filtering most used Description words
-desc_words = ''.join(df['Description'].str.lower()).split()
-# From these words, we need to remove the stop words.
-stopwords_en = stopwords.words('english')
-desc_words_filtered = [word for word in desc_words if word not in stopwords_en]
-# Fetching the 250 most common words in description
-desc_most_common = Counter(desc_words_filtered).most_common(250)
-desc_most_common = [word for word in desc_most_common if word[0] not in string.punctuation]
-print(f"Fetched {len(desc_most_common)} most common words...")
-
-print("Dumping categories, tags and most common words into pickle...")
-with open(os.path.join(base_path, 'music_identify_data/top_categories.pkl'), 'wb') as cats:
-    pickle.dump(top_categories, cats)
-
-with open(os.path.join(base_path, 'music_identify_data/top_tags.pkl'), 'wb') as tags:
-    pickle.dump(top_tags, tags)
+# Every description is split into words on its own, without stopwords and punctuation.
+print(f"Fetched {len(stats.top('desc_words', n_desc_words))} most common words...")
 
-with open(os.path.join(base_path, 'music_identify_data/top_desc_words.pkl'), 'wb') as desc:
-    pickle.dump(desc_most_common, desc)
+print("Dumping categories, tags and most common words into the model file...")
+model = stats.to_model(n_categories, n_tags, n_desc_words)
+model.save(os.path.join(base_path, 'music_identify_data/music_model.bin'))
 
 print("Complete...")
 
@@ -141,6 +111,6 @@ print("Complete...")
 
 # Fetched top-2 categories that account for 97.53 % music videos...
 # Fetched 750 most common tags...
-# Fetched 245 most common words...
-# Dumping categories, tags and most common words into pickle...
+# Fetched 250 most common words...
+# Dumping categories, tags and most common words into the model file...
 # Complete...
\ No newline at end of file
@@ -0,0 +1,94 @@
+r'''
+Tokenizer for the video descriptions, the largest field of our data.
+
+A description is lower-cased and split on whitespace, and its stopwords are removed.
+IdentifyMusicVideo only needs to know if any of these words belongs to the reference
+vocabulary, which doesn't require building the list of words at all:
+    - The stopwords are removed from the vocabulary once, instead of from every description.
+    - The check is a single frozenset.isdisjoint over the words of the description,
+    which stops at the first hit.
+
+For very large histories, the check can be spread over a pool of processes. The
+vocabulary is sent to every worker once, when the pool starts.
+'''
+
+import re
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# Tokenizer of the worker processes, set once by init_worker.
+worker_tokenizer = None
+
+
+def init_worker(vocabulary, stop_words):
+    global worker_tokenizer
+    worker_tokenizer = DescriptionTokenizer(vocabulary, stop_words)
+
+
+def check_in_worker(descriptions):
+    return worker_tokenizer.check_all(descriptions)
+
+
+class DescriptionTokenizer:
+    '''
+    Splits descriptions into words and checks them against a vocabulary.
+    '''
+
+    # Runs of non-whitespace characters, the same words str.split() would give.
+    word_pattern = re.compile(r'\S+')
+
+    def __init__(self, vocabulary, stop_words=()):
+        '''
+        param vocabulary -> Words we are looking for in the descriptions.
+        param stop_words -> Words that are ignored.
+        '''
+        self.stop_words = frozenset(stop_words)
+        self.vocabulary = frozenset(vocabulary) - self.stop_words
+
+    def tokenize(self, description):
+        '''
+        returns the list of lower-cased words of the description, without stopwords.
+        A missing description gives an empty list.
+        '''
+        if not isinstance(description, str):
+            return []
+        stop_words = self.stop_words
+        return [word for word in self.word_pattern.findall(description.lower()) if word not in stop_words]
+
+    def matches(self, description):
+        '''
+        returns True if any word of the description belongs to the vocabulary.
+        '''
+        return isinstance(description, str) and not self.vocabulary.isdisjoint(description.lower().split())
+
+    def check_all(self, descriptions):
+        '''
+        param descriptions -> Iterable of descriptions.
+
+        returns an int8 array, 1 where the description has a word of the vocabulary.
+        '''
+        matches = self.matches
+        return np.fromiter((matches(description) for description in descriptions), dtype=np.int8)
+
+    def check(self, descriptions, n_jobs=1, min_rows_per_job=20000):
+        '''
+        param descriptions -> Series of descriptions.
+        param n_jobs -> Number of processes to spread the check over.
+        param min_rows_per_job -> Below this many rows per process, the pool isn't worth
+        starting and the check runs in this process.
+
+        returns an int8 array, 1 where the description has a word of the vocabulary.
+        '''
+        descriptions = descriptions.to_numpy()
+        n_jobs = min(n_jobs, len(descriptions) // min_rows_per_job)
+        if n_jobs <= 1:
+            return self.check_all(descriptions)
+
+        # A few chunks per process, handed out in order.
+        chunks = np.array_split(descriptions, n_jobs * 4)
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=init_worker,
+            initargs=(self.vocabulary, self.stop_words),
+        ) as executor:
+            return np.concatenate(list(executor.map(check_in_worker, chunks)))
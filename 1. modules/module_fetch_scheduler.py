@@ -0,0 +1,124 @@
+r"""
+Scheduler that lets FetchVideoDetails spread a large fetch over several days.
+
+The YouTube Data API gives every project a daily quota (10000 units by default) and
+every videos().list request costs 1 unit, failed ones included. The scheduler:
+    - Counts the units spent per day (the quota resets at midnight Pacific Time) and
+    refuses to spend more than the daily budget, so the fetch stops cleanly.
+    - Checkpoints every completed batch to disk as soon as it arrives.
+    - On the next invocation, hands the checkpointed details back so that only the
+    remaining VideoIDs are requested, resuming exactly where it left off.
+"""
+
+import os
+import json
+import threading
+import pandas as pd
+
+
+class FetchScheduler:
+    """
+    Quota ledger and batch checkpoint of a fetch, both kept in checkpoint_dir.
+    """
+
+    def __init__(self, checkpoint_dir, daily_quota=10000, units_per_request=1):
+        """
+        param checkpoint_dir -> Directory holding the quota ledger and the fetched batches.
+        param daily_quota -> Maximum number of quota units spent per day.
+        param units_per_request -> Quota cost of one request (1 for videos().list).
+        """
+        self.daily_quota = daily_quota
+        self.units_per_request = units_per_request
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.ledger_path = os.path.join(checkpoint_dir, 'quota_ledger.json')
+        self.batches_path = os.path.join(checkpoint_dir, 'fetched_batches.jsonl')
+        self.lock = threading.Lock()
+        self.ledger = {'day': None, 'units_used': 0}
+        if os.path.isfile(self.ledger_path):
+            with open(self.ledger_path, 'r', encoding='utf-8') as file:
+                self.ledger = json.load(file)
+
+    @staticmethod
+    def quota_day():
+        '''
+        The API quota resets at midnight Pacific Time, so that's the day we count in.
+        '''
+        return pd.Timestamp.now(tz='America/Los_Angeles').date().isoformat()
+
+    @property
+    def units_used(self):
+        '''
+        Number of units spent today.
+        '''
+        return self.ledger['units_used'] if self.ledger['day'] == self.quota_day() else 0
+
+    def reserve(self, units=None):
+        '''
+        param units -> Units about to be spent, a single request by default.
+
+        returns True and records the units if they fit in today's budget, False otherwise.
+        '''
+        units = self.units_per_request if units is None else units
+        with self.lock:
+            units_used = self.units_used
+            if units_used + units > self.daily_quota:
+                return False
+            self.ledger = {'day': self.quota_day(), 'units_used': units_used + units}
+            self.save_ledger()
+            return True
+
+    def exhaust(self):
+        '''
+        Marks today's budget as spent, e.g. when the API itself reports that the quota
+        was exceeded by some other usage of the project.
+        '''
+        with self.lock:
+            self.ledger = {'day': self.quota_day(), 'units_used': self.daily_quota}
+            self.save_ledger()
+
+    def save_ledger(self):
+        temp_path = self.ledger_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.ledger, file)
+        os.replace(temp_path, self.ledger_path)
+
+    def checkpoint(self, batch_ids, batch_details):
+        '''
+        param batch_ids -> VideoIDs requested in the batch.
+        param batch_details -> Details returned by the API for the batch.
+
+        Appends the completed batch to the checkpoint file and flushes it to disk.
+        '''
+        line = json.dumps({'ids': list(batch_ids), 'details': batch_details})
+        with self.lock:
+            with open(self.batches_path, 'a', encoding='utf-8') as file:
+                file.write(line + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+
+    def completed(self):
+        '''
+        returns a dictionary with key: VideoID and value: its details (None if the API didn't
+        return the video) for every VideoID of the checkpointed batches.
+        '''
+        fetched = {}
+        if not os.path.isfile(self.batches_path):
+            return fetched
+        with open(self.batches_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    batch = json.loads(line)
+                except json.JSONDecodeError:
+                    # A batch cut short by a crash is simply fetched again.
+                    continue
+                fetched.update(dict.fromkeys(batch['ids']))
+                fetched.update((details['VideoID'], details) for details in batch['details'])
+        return fetched
+
+    def clear(self):
+        '''
+        Removes the checkpointed batches once the whole fetch has been saved elsewhere.
+        The quota ledger is kept.
+        '''
+        if os.path.isfile(self.batches_path):
+            os.remove(self.batches_path)
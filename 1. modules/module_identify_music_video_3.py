@@ -17,13 +17,42 @@ if a video is a music video:
 '''
 
 import os
-import pickle
+import time
+import numpy as np
 import pandas as pd
 from nltk.corpus import stopwords
+from module_description_tokenizer import DescriptionTokenizer
+from module_music_model import MusicVideoModel
+from module_music_scorer import MusicVideoScorer
+from module_storage import as_list
+from concurrent.futures import ProcessPoolExecutor
 
 # SettingWithCopy Warning disable
 pd.options.mode.chained_assignment = None
 
+# Classifier of the worker processes, set once by init_worker.
+worker_classifier = None
+
+
+def init_worker(model_file, scorer_options):
+    global worker_classifier
+    # Every worker maps the model file itself, instead of receiving the vocabularies with each shard.
+    worker_classifier = IdentifyMusicVideo(None, model_file=model_file, scorer_options=scorer_options)
+    worker_classifier.get_cat_tag_desc()
+
+
+def classify_in_worker(df_shard):
+    df_filtered_music = worker_classifier.classify_shard(df_shard)
+    # Sending back only what the parent doesn't have: the positions of the kept rows in
+    # the shard, their checks, and their words joined in a single string (much faster to
+    # pickle than lists of words).
+    return (
+        df_filtered_music.index.to_numpy(),
+        df_filtered_music[['CategoryCheck', 'TagsCheck', 'DescriptionCheck']].to_numpy(dtype='int8'),
+        df_filtered_music['Description'].str.join(' ').to_numpy(),
+        )
+
+
 class IdentifyMusicVideo:
     '''
     Class that attempts to identify a music video using the categoryID,
@@ -32,39 +61,57 @@ class IdentifyMusicVideo:
     
     base_path = os.path.dirname(__file__)
     
-    def __init__(self, df_history_details):
+    def __init__(self, df_history_details, n_jobs=1, min_rows_per_job=20000, model_file=None, scorer_options=None):
         '''
         param df_history_details -> Dataframe containing watched VideoID, Title,
         CategoryID, Description and Tags.
+        param n_jobs -> Number of processes the classification can be spread over.
+        param min_rows_per_job -> Below this many rows per process, the pool isn't worth
+        starting and the classification runs in this process.
+        param model_file -> Model file of the reference vocabularies, the one written by
+        the experiments script by default.
+        param scorer_options -> Keyword arguments of the MusicVideoScorer (weights and thresholds).
         '''
         self.df_history_details = df_history_details
-        self.cat_file = os.path.join(self.base_path, '../0. music_vid_identify/music_identify_data/top_categories.pkl')
-        self.tags_file = os.path.join(self.base_path, '../0. music_vid_identify/music_identify_data/top_tags.pkl')
-        self.desc_words_file = os.path.join(self.base_path, '../0. music_vid_identify/music_identify_data/top_desc_words.pkl')
+        self.n_jobs = n_jobs
+        self.min_rows_per_job = min_rows_per_job
+        self.tokenizer = None
+        self.scorer = None
+        self.scorer_options = scorer_options or {}
+        if model_file is None:
+            model_file = os.path.join(self.base_path, '../0. music_vid_identify/music_identify_data/music_model.bin')
+        self.model_file = model_file
+        self.vocabularies = None
         
     def get_cat_tag_desc(self):
         '''
-        Function to open the pickle file containing the most popular CategoryID,
+        Function to load the model file containing the most popular CategoryID,
         Tags and Description words. 
         
-        Returns a list of each.
+        Returns a frozenset of each, so that every lookup is a hash lookup.
+        The model file is read once per process, and shared by every instance.
         '''
-        with open(self.cat_file, 'rb') as file:
-            tc = pickle.load(file)
-            # To obtain the list of top categories
-            tc = list(map(int, tc.index))
-            
-        with open(self.tags_file, 'rb') as file:
-            tt = pickle.load(file)
-            # To obtain the list of top tags
-            tt = [tag_value[0] for tag_value in tt]
-            
-        with open(self.desc_words_file, 'rb') as file:
-            tdw = pickle.load(file)
-            # To obtain the list of top description words
-            tdw = [desc_word_value[0] for desc_word_value in tdw]
-            
-        return tc, tt, tdw
+        if self.vocabularies is None:
+            self.vocabularies = MusicVideoModel.load(self.model_file).vocabularies()
+        return self.vocabularies
+
+    def get_scorer(self):
+        '''
+        Returns the MusicVideoScorer of the model file, built on the first call.
+        '''
+        if self.scorer is None:
+            self.scorer = MusicVideoScorer(MusicVideoModel.load(self.model_file), **self.scorer_options)
+        return self.scorer
+
+    @staticmethod
+    def as_tag_list(tags):
+        '''
+        param tags -> Tags of a video: a list, None/nan if it has none, or the string
+        representation of a list once the dataframe went through a csv file.
+
+        returns the tags as a list.
+        '''
+        return as_list(tags)
     
     
     def filter_by_category(self, category_ids):
@@ -76,9 +123,16 @@ class IdentifyMusicVideo:
         '''
         category_ids = list(map(int, category_ids))
         
-        self.df_history_details['CategoryCheck'] = self.df_history_details['CategoryID'].apply(
-            lambda x: 1 if int(x) in category_ids else 0
-            )
+        # CategoryID is a string when fetched from the API, an integer when read from a csv,
+        # and usually a categorical of either: then only its categories are checked.
+        category = self.df_history_details['CategoryID']
+        if isinstance(category.dtype, pd.CategoricalDtype):
+            top_categories = pd.to_numeric(category.cat.categories.to_series(), errors='coerce').isin(category_ids)
+            # Missing categories have the code -1, which picks the False at the end.
+            category_check = np.append(top_categories.to_numpy(), False)[category.cat.codes.to_numpy()]
+        else:
+            category_check = pd.to_numeric(category, errors='coerce').isin(category_ids).to_numpy()
+        self.df_history_details['CategoryCheck'] = category_check.astype('int8')
     
     def filter_by_tags(self, tags):
         '''
@@ -87,13 +141,20 @@ class IdentifyMusicVideo:
         Function creates a column called TagsCheck which is 1 if the tag belongs
         to the top 750, 0 otherwise.
         '''
-        # Replacing nan/None tags (if any) with an empty string
-        self.df_history_details['Tags'].fillna(' ', inplace=True)
+        tags = frozenset(tags)
         
-        # Setting TagsCheck=1, if tags belong to the top-750
-        self.df_history_details['TagsCheck'] = self.df_history_details['Tags'].apply(
-            lambda x: 1 if [common_tag for common_tag in x if common_tag in tags] else 0
-            )
+        # One row per (video, tag) pair, indexed by the position of the video. The tags are
+        # compared in lower case, like the vocabulary and the MusicVideoScorer do.
+        all_tags = pd.Series(
+            self.df_history_details['Tags'].map(IdentifyMusicVideo.as_tag_list).to_numpy()
+            ).explode().str.lower()
+        
+        # Setting TagsCheck=1, if any of the tags belong to the top-750
+        tags_check = all_tags.isin(tags).groupby(level=0).any()
+        self.df_history_details['TagsCheck'] = tags_check.to_numpy().astype('int8')
+        
+        # Replacing nan/None tags (if any) with an empty string
+        self.df_history_details['Tags'] = self.df_history_details['Tags'].fillna(' ')
         
     def filter_by_description(self, desc_words):
         '''
@@ -102,38 +163,26 @@ class IdentifyMusicVideo:
         
         Function creates a column called DescriptionCheck which is 1 if the Description
         contains words that belong to the top 500, 0 otherwise.
+        The descriptions are checked as they are, without building lists of words.
         '''
-        stopwords_en = stopwords.words('english')
-        
-        # self.df_history_details['AllDescWords'] = self.df_history_details.apply(lambda x: desc_words, axis=1)
-        # If Description is empty, add a blank string, else convert it to lower case.
-        self.df_history_details['DescExists'] = self.df_history_details['Description'].apply(
-            lambda x: x.lower() if pd.notna(x) else ' '
-            )
+        if self.tokenizer is None:
+            self.tokenizer = DescriptionTokenizer(desc_words, stopwords.words('english'))
         
-        # Split the description into a list of words and remove the stopwords.
-        self.df_history_details['Description'] = self.df_history_details['DescExists'].apply(
-            lambda x: [word for word in x.split() if word not in stopwords_en]
-            )
         # DescriptionCheck column = 1 if description has words that belong to top-250
-        self.df_history_details['DescriptionCheck'] = self.df_history_details['Description'].apply(
-            lambda x: 1 if [cw for cw in x if cw in desc_words] else 0
+        self.df_history_details['DescriptionCheck'] = self.tokenizer.check(
+            self.df_history_details['Description'], n_jobs=self.n_jobs
             )
         
-    def filter_music_video(self):
-        '''
-        If a video doesn't satisfy any of the category, tags or description checks
-        it's almost certainly not a Music Video.
-        
-        This function filters such videos and returns a dataframe only with necessary
-        details which are: 
-            'VideoID', 'Title', 'CategoryID', 'Description',
-            'Tags', 'CategoryCheck', 'AllDescWordsTagsCheck',
-            'DescriptionCheck'.
+    def classify_shard(self, df_shard):
         '''
+        param df_shard -> Part of the details dataframe.
 
+        Runs the Duration filter and the three checks on df_shard, and returns the videos
+        that pass at least one check, with the description split into words. The rows keep
+        the index they had in df_shard.
+        '''
         # Removing YouTube shorts(videos with duration 60s or less)
-        self.df_history_details = self.df_history_details.loc[self.df_history_details['Duration']>60]
+        self.df_history_details = df_shard.loc[df_shard['Duration']>60]
         
         # Creating checks for tags, category and description words.
         top_ids, top_tags, top_desc_words = self.get_cat_tag_desc()
@@ -148,9 +197,112 @@ class IdentifyMusicVideo:
             & (self.df_history_details['DescriptionCheck'] == 0)
             )]
         
+        # Split the description of the videos we keep into a list of words without the stopwords.
+        df_filtered_music['Description'] = df_filtered_music['Description'].map(self.tokenizer.tokenize)
+        return df_filtered_music
+
+    def score_videos(self, df_videos):
+        '''
+        param df_videos -> Dataframe with the CategoryID, Tags and Description (as a list
+        of words) of videos, read from a csv file or not.
+
+        Returns the MusicScore of every video, see module_music_scorer.
+        '''
+        return self.get_scorer().score(
+            df_videos['CategoryID'],
+            df_videos['Tags'].map(IdentifyMusicVideo.as_tag_list),
+            df_videos['Description'].map(IdentifyMusicVideo.as_tag_list),
+            )
+        
+    def filter_music_video(self):
+        '''
+        If a video doesn't satisfy any of the category, tags or description checks
+        it's almost certainly not a Music Video.
+        
+        This function filters such videos and returns a dataframe only with necessary
+        details which are: 
+            'VideoID', 'Title', 'ChannelTitle', 'CategoryID', 'Description',
+            'Tags', 'CategoryCheck', 'AllDescWordsTagsCheck',
+            'DescriptionCheck'.
+        along with 'PlayCount', 'FirstSeen' and 'LastSeen' if the history has them.
+        The MusicScore isn't computed here, only when the videos are triaged by it.
+        
+        With n_jobs > 1, the dataframe is split into shards that are classified on a pool
+        of processes and put back together in their original order, which gives the same
+        result as classifying it in one go.
+        '''
+        df_history_details = self.df_history_details
+        n_jobs = min(self.n_jobs, len(df_history_details) // self.min_rows_per_job)
+        
+        if n_jobs <= 1:
+            df_filtered_music = self.classify_shard(df_history_details)
+        else:
+            # A few shards per process, handed out in order. They only carry the columns
+            # the checks need, indexed by position.
+            check_columns = df_history_details[['Duration', 'CategoryID', 'Tags', 'Description']]
+            all_positions = np.array_split(np.arange(len(df_history_details)), n_jobs * 4)
+            shards = [check_columns.iloc[positions].reset_index(drop=True) for positions in all_positions]
+            with ProcessPoolExecutor(
+                max_workers=n_jobs,
+                initializer=init_worker,
+                initargs=(self.model_file, self.scorer_options),
+            ) as executor:
+                results = list(executor.map(classify_in_worker, shards))
+            
+            kept_positions = np.concatenate([
+                positions[kept] for positions, (kept, _, _) in zip(all_positions, results)
+                ])
+            df_filtered_music = df_history_details.iloc[kept_positions]
+            checks = np.concatenate([shard_checks for _, shard_checks, _ in results])
+            df_filtered_music['CategoryCheck'] = checks[:, 0]
+            df_filtered_music['TagsCheck'] = checks[:, 1]
+            df_filtered_music['DescriptionCheck'] = checks[:, 2]
+            df_filtered_music['Tags'] = df_filtered_music['Tags'].fillna(' ')
+            descriptions = np.concatenate([shard_descriptions for _, _, shard_descriptions in results])
+            df_filtered_music['Description'] = [description.split() for description in descriptions]
+        
         # Reseting the index and choosing a subset of necessary columns
         df_filtered_music.reset_index(drop=True, inplace=True)
-        reqd_details = ['VideoID', 'Title', 'CategoryID', 'Description', 'Tags', 'CategoryCheck', 'TagsCheck', 'DescriptionCheck']
+        reqd_details = [
+            'VideoID', 'Title', 'ChannelTitle', 'CategoryID', 'Description',
+            'Tags', 'CategoryCheck', 'TagsCheck', 'DescriptionCheck',
+            ]
+        reqd_details += [col for col in ['PlayCount', 'FirstSeen', 'LastSeen'] if col in df_filtered_music.columns]
         return df_filtered_music[reqd_details] 
 
 ###############################################################################
+
+def benchmark_filter_music_video(sizes=(1000, 10000, 100000, 1000000), n_jobs=os.cpu_count()):
+    '''
+    Times filter_music_video on synthetic histories of increasing size, built from
+    the reference vocabularies so that every check gets some hits, in one process
+    and sharded over n_jobs processes.
+    '''
+    rng = np.random.default_rng(23)
+    top_ids, top_tags, top_desc_words = IdentifyMusicVideo(None).get_cat_tag_desc()
+    tag_pool = np.array(sorted(top_tags) + [f'other tag {i}' for i in range(750)], dtype=object)
+    word_pool = np.array(sorted(top_desc_words) + [f'word{i}' for i in range(1000)], dtype=object)
+
+    for size in sizes:
+        n_tags = rng.integers(0, 12, size)
+        df = pd.DataFrame({
+            'VideoID': [f'{i:011d}' for i in range(size)],
+            'Title': 'Some title',
+            'ChannelTitle': 'Some channel',
+            'CategoryID': rng.choice(['10', '24', '22', '20', '27'], size),
+            'Duration': rng.integers(30, 600, size),
+            'Tags': [list(rng.choice(tag_pool, n)) if n else None for n in n_tags],
+            'Description': [' '.join(rng.choice(word_pool, 40)) for _ in range(size)],
+            })
+        start = time.perf_counter()
+        df_music = IdentifyMusicVideo(df).filter_music_video()
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        df_music_sharded = IdentifyMusicVideo(df, n_jobs=n_jobs).filter_music_video()
+        elapsed_sharded = time.perf_counter() - start
+        pd.testing.assert_frame_equal(df_music, df_music_sharded)
+        print(f"{size:>8} videos: {elapsed:7.2f}s, {elapsed_sharded:7.2f}s on {n_jobs} processes ({len(df_music)} kept)")
+
+
+if __name__ == '__main__':
+    benchmark_filter_music_video()
@@ -0,0 +1,312 @@
+r'''
+Listening analytics of the watch history, answered from small precomputed aggregates.
+
+Every play of the watch events is counted once, when it's ingested, into rollups kept in a
+SQLite database: the number of plays of every song (VideoID), channel and category, and
+in total, per day, week (starting on Monday) and month. Periods are in the local time zone
+given when the rollups are created.
+    - New plays are added to the rollups incrementally: only the plays after the latest
+    WatchDate counted so far are counted, so the same events can be fed again safely.
+    - Plays per period, the top-N of every period and yearly "wrapped" reports are queries
+    over the rollups, never over the watch events.
+
+Plays of videos without details (deleted or private) count for the song and the total, but
+not for any channel or category.
+'''
+
+import sys
+import time
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+# Periods of the rollups, and the dimensions the plays are counted along.
+periods = ('day', 'week', 'month')
+dimensions = ('total', 'song', 'channel', 'category')
+
+
+class ListeningAnalytics:
+    '''
+    Rollups of the number of plays per period and dimension, backed by SQLite.
+    '''
+
+    def __init__(self, db_path, timezone='UTC'):
+        '''
+        param db_path -> Path of the SQLite database, created if it doesn't exist.
+        param timezone -> Time zone the days, weeks and months are counted in. It can't be
+        changed once plays have been counted.
+        '''
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS rollups ("
+                "Period TEXT NOT NULL, Dimension TEXT NOT NULL, PeriodStart TEXT NOT NULL, "
+                "Key TEXT NOT NULL, Plays INTEGER NOT NULL, "
+                "PRIMARY KEY (Period, Dimension, PeriodStart, Key)) WITHOUT ROWID"
+            )
+            # Title of every song, shown along with its VideoID.
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS labels ("
+                "Dimension TEXT NOT NULL, Key TEXT NOT NULL, Label TEXT, "
+                "PRIMARY KEY (Dimension, Key)) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS state (Name TEXT PRIMARY KEY, Value TEXT NOT NULL)"
+            )
+            self.connection.execute(
+                "INSERT OR IGNORE INTO state (Name, Value) VALUES ('timezone', ?)", (timezone,)
+            )
+        self.timezone = self.get_state('timezone')
+        if self.timezone != timezone:
+            raise ValueError(
+                f"The rollups of {db_path} are counted in {self.timezone}, not {timezone}."
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get_state(self, name):
+        row = self.connection.execute("SELECT Value FROM state WHERE Name = ?", (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    @property
+    def last_watch_date(self):
+        '''
+        Latest WatchDate counted so far as a UTC Timestamp, None before any play is counted.
+        '''
+        with self.lock:
+            last_watch_date = self.get_state('last_watch_date')
+        return pd.Timestamp(last_watch_date) if last_watch_date else None
+
+    @staticmethod
+    def period_starts(local_dates):
+        '''
+        param local_dates -> Array of the dates of the plays, in local time without time zone.
+
+        returns a dictionary with key: period and value: the start of the period of every play,
+        as a datetime64[D] array.
+        '''
+        days = local_dates.astype('datetime64[D]')
+        # 1970-01-01, day 0, was a Thursday: the week of day d started (d + 3) % 7 days before.
+        day_numbers = days.astype('int64')
+        return {
+            'day': days,
+            'week': (day_numbers - (day_numbers + 3) % 7).astype('datetime64[D]'),
+            'month': local_dates.astype('datetime64[M]').astype('datetime64[D]'),
+            }
+
+    @staticmethod
+    def count_plays(starts, key_codes, keys):
+        '''
+        param starts -> Start of the period of every play.
+        param key_codes -> Position in keys (sorted) of the key of every play, -1 for none.
+
+        returns a list of (PeriodStart, Key, Plays) of every period and key that have plays,
+        in the order of the primary key.
+        '''
+        has_key = key_codes >= 0
+        day_numbers = starts[has_key].astype('int64')
+        # Every (period, key) pair as a single integer, counted in one pass.
+        pairs, plays = np.unique(day_numbers * len(keys) + key_codes[has_key], return_counts=True)
+        period_starts = np.datetime_as_string((pairs // len(keys)).astype('datetime64[D]'), unit='D')
+        keys = np.asarray(keys, dtype=object)[pairs % len(keys)]
+        return list(zip(period_starts.tolist(), keys.tolist(), plays.tolist()))
+
+    def add_events(self, df_events, df_details):
+        '''
+        param df_events -> Dataframe of watch events, with the VideoID and WatchDate of every play.
+        param df_details -> Dataframe of video details, with their VideoID, Title, ChannelTitle
+        and CategoryID.
+
+        Counts the plays after the latest WatchDate counted so far into the rollups,
+        returns their number.
+        '''
+        watch_dates = pd.to_datetime(df_events['WatchDate'], utc=True)
+        last_watch_date = self.last_watch_date
+        new_plays = watch_dates.notna().to_numpy()
+        if last_watch_date is not None:
+            new_plays &= (watch_dates > last_watch_date).to_numpy()
+        if not new_plays.any():
+            return 0
+        watch_dates = watch_dates[new_plays]
+        video_ids = df_events['VideoID'][new_plays].astype(str).reset_index(drop=True)
+
+        # Every play is given the code of its song, channel and category, in sorted order so
+        # that the rollups come out in the order of the primary key.
+        song_codes, songs = pd.factorize(video_ids, sort=True)
+        details = df_details.drop_duplicates(subset=['VideoID']).set_index('VideoID').reindex(songs)
+        category_ids = details['CategoryID'].astype(object)
+        channel_codes, channels = pd.factorize(details['ChannelTitle'].astype(object), sort=True)
+        category_codes, categories = pd.factorize(
+            category_ids.where(category_ids.isna(), category_ids.astype(str)), sort=True
+            )
+        keys = {
+            'total': (np.zeros(len(song_codes), dtype='int64'), ['']),
+            'song': (song_codes, songs),
+            'channel': (channel_codes[song_codes], channels),
+            'category': (category_codes[song_codes], categories),
+            }
+        local_dates = watch_dates.dt.tz_convert(self.timezone).dt.tz_localize(None).to_numpy()
+
+        rows = []
+        for period, starts in ListeningAnalytics.period_starts(local_dates).items():
+            for dimension, (key_codes, dimension_keys) in keys.items():
+                rows += [
+                    (period, dimension, period_start, key, plays) for period_start, key, plays
+                    in ListeningAnalytics.count_plays(starts, key_codes, dimension_keys)
+                    ]
+
+        played = details.dropna(subset=['Title'])
+        labels = [('song', video_id, title) for video_id, title in zip(played.index, played['Title'])]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO rollups (Period, Dimension, PeriodStart, Key, Plays) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (Period, Dimension, PeriodStart, Key) DO UPDATE SET Plays = Plays + excluded.Plays",
+                rows,
+                )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO labels (Dimension, Key, Label) VALUES (?, ?, ?)", labels
+                )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO state (Name, Value) VALUES ('last_watch_date', ?)",
+                (watch_dates.max().isoformat(),),
+                )
+        return int(new_plays.sum())
+
+    @staticmethod
+    def period_filter(start, end):
+        '''
+        returns the SQL condition and parameters keeping the periods starting between start
+        and end (dates as 'yyyy-mm-dd' strings or Timestamps), both included.
+        '''
+        conditions, parameters = [], []
+        if start is not None:
+            conditions.append("AND PeriodStart >= ?")
+            parameters.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+        if end is not None:
+            conditions.append("AND PeriodStart <= ?")
+            parameters.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+        return ' '.join(conditions), parameters
+
+    def plays(self, period='month', dimension='total', start=None, end=None):
+        '''
+        param period -> 'day', 'week' or 'month'.
+        param dimension -> 'total', 'song', 'channel' or 'category'.
+        param start, end -> First and last period to return, all of them by default.
+
+        returns a dataframe of the number of plays of every key (VideoID, channel, category,
+        or '' for the total) in every period, with the Title of the songs as Label.
+        '''
+        condition, parameters = ListeningAnalytics.period_filter(start, end)
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT PeriodStart, Key, Label, Plays FROM rollups LEFT JOIN labels USING (Dimension, Key) "
+                f"WHERE Period = ? AND Dimension = ? {condition} ORDER BY PeriodStart, Plays DESC, Key",
+                [period, dimension, *parameters],
+                ).fetchall()
+        return pd.DataFrame(rows, columns=['PeriodStart', 'Key', 'Label', 'Plays'])
+
+    def top(self, period='month', dimension='song', n=10, start=None, end=None):
+        '''
+        returns a dataframe of the n most played keys of every period, with their Rank.
+        '''
+        condition, parameters = ListeningAnalytics.period_filter(start, end)
+        rows = []
+        with self.lock:
+            period_starts = self.connection.execute(
+                "SELECT PeriodStart FROM rollups "
+                f"WHERE Period = ? AND Dimension = 'total' {condition} ORDER BY PeriodStart",
+                [period, *parameters],
+                ).fetchall()
+            # The keys of a period are a range of the primary key, of which only the top n are sorted.
+            for (period_start,) in period_starts:
+                top_keys = self.connection.execute(
+                    "SELECT top_keys.Key, Label, Plays FROM ("
+                    "SELECT Dimension, Key, Plays FROM rollups WHERE Period = ? AND Dimension = ? AND PeriodStart = ? "
+                    "ORDER BY Plays DESC, Key LIMIT ?) AS top_keys LEFT JOIN labels USING (Dimension, Key) "
+                    "ORDER BY Plays DESC, top_keys.Key",
+                    (period, dimension, period_start, n),
+                    )
+                rows += [(period_start, rank, *row) for rank, row in enumerate(top_keys, start=1)]
+        return pd.DataFrame(rows, columns=['PeriodStart', 'Rank', 'Key', 'Label', 'Plays'])
+
+    def wrapped(self, year, dimension='song', n=5):
+        '''
+        returns a dataframe of the n most played keys of the year, summed over its months.
+        '''
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT top_keys.Key, Label, Plays FROM ("
+                "SELECT Dimension, Key, SUM(Plays) AS Plays FROM rollups "
+                "WHERE Period = 'month' AND Dimension = ? AND PeriodStart >= ? AND PeriodStart < ? "
+                "GROUP BY Key ORDER BY Plays DESC, Key LIMIT ?) AS top_keys LEFT JOIN labels USING (Dimension, Key) "
+                "ORDER BY Plays DESC, top_keys.Key",
+                (dimension, f'{year}-01-01', f'{int(year) + 1}-01-01', n),
+                ).fetchall()
+        return pd.DataFrame(rows, columns=['Key', 'Label', 'Plays'])
+
+    def date_range(self):
+        '''
+        returns the first and last day with plays, as Timestamps (None without any play).
+        '''
+        with self.lock:
+            first_day, last_day = self.connection.execute(
+                "SELECT MIN(PeriodStart), MAX(PeriodStart) FROM rollups WHERE Period = 'day' AND Dimension = 'total'"
+                ).fetchone()
+        if first_day is None:
+            return None, None
+        return pd.Timestamp(first_day), pd.Timestamp(last_day)
+
+###############################################################################
+
+def benchmark_analytics(db_path, n_events=5000000, n_videos=50000):
+    '''
+    Times the ingestion of n_events synthetic plays into new rollups at db_path, in two
+    halves, and queries over the rollups.
+    '''
+    rng = np.random.default_rng(23)
+    video_ids = np.array([f'{video:011d}' for video in range(n_videos)], dtype=object)
+    df_details = pd.DataFrame({
+        'VideoID': video_ids,
+        'Title': [f'Song {video}' for video in range(n_videos)],
+        'ChannelTitle': pd.Categorical([f'Channel {video % 2000}' for video in range(n_videos)]),
+        'CategoryID': pd.Categorical(rng.choice(['10', '24', '22', '20'], n_videos)),
+        })
+    start_date = pd.Timestamp('2019-01-01', tz='UTC')
+    df_events = pd.DataFrame({
+        'VideoID': video_ids[rng.zipf(1.3, n_events) % n_videos],
+        'WatchDate': start_date + pd.to_timedelta(np.sort(rng.integers(0, 4 * 365 * 86400, n_events)), unit='s'),
+        })
+
+    with ListeningAnalytics(db_path) as analytics:
+        for half in np.array_split(np.arange(n_events), 2):
+            started = time.perf_counter()
+            n_added = analytics.add_events(df_events.iloc[half], df_details)
+            print(f"Counted {n_added} plays in {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        n_added = analytics.add_events(df_events, df_details)
+        print(f"Counted {n_added} plays again in {time.perf_counter() - started:.2f}s")
+
+        queries = {
+            'plays per month': lambda: analytics.plays('month'),
+            'top 10 songs of every week': lambda: analytics.top('week', 'song', 10),
+            'top 5 channels of a year': lambda: analytics.wrapped(2021, 'channel'),
+            }
+        for name, query in queries.items():
+            started = time.perf_counter()
+            query()
+            print(f"{name}: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    benchmark_analytics(sys.argv[1] if len(sys.argv) > 1 else 'ListeningAnalytics_benchmark.sqlite')
@@ -0,0 +1,221 @@
+r'''
+The reference vocabularies used to identify a music video, in a single compact file.
+
+The file holds the top CategoryIDs, the top Tags and the top Description words of the
+music playlist, each with its count. Unlike the pickles, it doesn't depend on pandas and
+can be memory-mapped: loading it reads a small JSON header and maps the rest, so short-lived
+workers and parallel shards can open it almost for free.
+
+File layout (little-endian):
+    - 8 bytes: b'SDBMUSIC'
+    - uint32: format version
+    - uint32: length of the JSON header
+    - JSON header: offset, dtype and length of every section
+    - sections, each aligned on 8 bytes: the category ids and counts, and for the tags and
+    description words a UTF-8 blob of all the strings, their end offsets and their counts.
+'''
+
+import os
+import json
+import mmap
+import time
+import struct
+import pickle
+import numpy as np
+
+
+class MusicVideoModel:
+    '''
+    Category IDs, tag vocabulary and description vocabulary (with counts) of music videos.
+    '''
+
+    magic = b'SDBMUSIC'
+    version = 1
+    # Models loaded by this process, keyed by path, along with the modification time and size
+    # of the file they were read from, so that every file is read only once.
+    loaded_models = {}
+
+    def __init__(self, category_ids, category_counts, tags, tag_counts, desc_words, desc_counts):
+        '''
+        param category_ids, category_counts -> Top CategoryIDs and the number of music videos of each.
+        param tags, tag_counts -> Top Tags and the number of times each was used.
+        param desc_words, desc_counts -> Top Description words and the number of times each was used.
+        '''
+        self.category_ids = np.asarray(category_ids, dtype='<i4')
+        self.category_counts = np.asarray(category_counts, dtype='<i4')
+        self.tags = list(tags)
+        self.tag_counts = np.asarray(tag_counts, dtype='<i4')
+        self.desc_words = list(desc_words)
+        self.desc_counts = np.asarray(desc_counts, dtype='<i4')
+        self.vocabulary_sets = None
+
+    def vocabularies(self):
+        '''
+        returns a frozenset of each of the category IDs, tags and description words,
+        built on the first call.
+        '''
+        if self.vocabulary_sets is None:
+            self.vocabulary_sets = (
+                frozenset(map(int, self.category_ids)),
+                frozenset(self.tags),
+                frozenset(self.desc_words),
+            )
+        return self.vocabulary_sets
+
+    @classmethod
+    def from_pickles(cls, cat_file, tags_file, desc_words_file):
+        '''
+        Builds the model from the three pickles the experiments script used to write:
+        a pandas Series of category counts and lists of (word, count) tuples.
+        '''
+        with open(cat_file, 'rb') as file:
+            top_categories = pickle.load(file)
+        with open(tags_file, 'rb') as file:
+            top_tags = pickle.load(file)
+        with open(desc_words_file, 'rb') as file:
+            top_desc_words = pickle.load(file)
+
+        return cls(
+            category_ids=list(map(int, top_categories.index)),
+            category_counts=list(top_categories.values),
+            tags=[tag for tag, _ in top_tags],
+            tag_counts=[count for _, count in top_tags],
+            desc_words=[word for word, _ in top_desc_words],
+            desc_counts=[count for _, count in top_desc_words],
+        )
+
+    @staticmethod
+    def encode_strings(strings):
+        '''
+        returns a UTF-8 blob of all the strings and the end offset of each of them.
+        '''
+        encoded = [string.encode('utf-8') for string in strings]
+        ends = np.cumsum([len(string) for string in encoded], dtype='<i4')
+        return b''.join(encoded), ends
+
+    @staticmethod
+    def decode_strings(blob, ends):
+        starts = np.concatenate(([0], ends[:-1]))
+        return [bytes(blob[start:end]).decode('utf-8') for start, end in zip(starts, ends)]
+
+    def save(self, path):
+        '''
+        Writes the model to path.
+        '''
+        tags_blob, tags_ends = MusicVideoModel.encode_strings(self.tags)
+        desc_blob, desc_ends = MusicVideoModel.encode_strings(self.desc_words)
+        sections = {
+            'category_ids': self.category_ids,
+            'category_counts': self.category_counts,
+            'tags_blob': np.frombuffer(tags_blob, dtype='u1'),
+            'tags_ends': tags_ends,
+            'tag_counts': self.tag_counts,
+            'desc_blob': np.frombuffer(desc_blob, dtype='u1'),
+            'desc_ends': desc_ends,
+            'desc_counts': self.desc_counts,
+        }
+
+        # Offsets are relative to the start of the data, which comes right after the header.
+        header = {'version': self.version, 'sections': {}}
+        offset = 0
+        for name, array in sections.items():
+            header['sections'][name] = {'offset': offset, 'dtype': array.dtype.str, 'length': len(array)}
+            offset += -(-array.nbytes // 8) * 8
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_start = -(-(len(self.magic) + 8 + len(header_bytes)) // 8) * 8
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(self.magic)
+            file.write(struct.pack('<II', self.version, len(header_bytes)))
+            file.write(header_bytes)
+            for name, array in sections.items():
+                file.seek(data_start + header['sections'][name]['offset'])
+                file.write(array.tobytes())
+            # Padding the last section, so the file size matches the layout.
+            file.truncate(data_start + offset)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def read(cls, path):
+        '''
+        Memory-maps the model file at path and returns the model. Use load() instead to
+        share the model across the process.
+        '''
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if mapped[:len(cls.magic)] != cls.magic:
+            raise ValueError(f"{path} is not a music video model file.")
+        version, header_length = struct.unpack_from('<II', mapped, len(cls.magic))
+        if version != cls.version:
+            raise ValueError(f"{path} has format version {version}, only version {cls.version} is supported.")
+        header_start = len(cls.magic) + 8
+        header = json.loads(mapped[header_start:header_start + header_length].decode('utf-8'))
+        data_start = -(-(header_start + header_length) // 8) * 8
+
+        arrays = {
+            name: np.frombuffer(
+                mapped, dtype=section['dtype'], count=section['length'],
+                offset=data_start + section['offset'],
+            )
+            for name, section in header['sections'].items()
+        }
+        model = cls.__new__(cls)
+        # The arrays are views on the mapped file, which stays open as long as the model.
+        model.mapped = mapped
+        model.category_ids = arrays['category_ids']
+        model.category_counts = arrays['category_counts']
+        model.tags = cls.decode_strings(arrays['tags_blob'], arrays['tags_ends'])
+        model.tag_counts = arrays['tag_counts']
+        model.desc_words = cls.decode_strings(arrays['desc_blob'], arrays['desc_ends'])
+        model.desc_counts = arrays['desc_counts']
+        model.vocabulary_sets = None
+        return model
+
+    def close(self):
+        '''
+        Unmaps the file of a model returned by read(). The model can't be used afterwards.
+        '''
+        mapped = getattr(self, 'mapped', None)
+        if mapped is None:
+            return
+        # The arrays are views on the mapped file, which can only be closed once they're gone.
+        self.category_ids = self.category_counts = self.tag_counts = self.desc_counts = None
+        self.mapped = None
+        try:
+            mapped.close()
+        except BufferError:
+            # Some of the arrays are still used elsewhere, the file is unmapped once they're freed.
+            pass
+
+    @classmethod
+    def load(cls, path):
+        '''
+        returns the model at path, reading the file only the first time it is asked for in
+        this process (or again if it changed since, the model read before being closed).
+        '''
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        file_version = (stat.st_mtime_ns, stat.st_size)
+        loaded = cls.loaded_models.get(path)
+        if loaded is None or loaded[0] != file_version:
+            if loaded is not None:
+                loaded[1].close()
+            cls.loaded_models[path] = (file_version, cls.read(path))
+        return cls.loaded_models[path][1]
+
+
+if __name__ == '__main__':
+    # Converts the pickles written by older versions of the experiments script.
+    data_path = os.path.join(os.path.dirname(__file__), '../0. music_vid_identify/music_identify_data')
+    model = MusicVideoModel.from_pickles(
+        os.path.join(data_path, 'top_categories.pkl'),
+        os.path.join(data_path, 'top_tags.pkl'),
+        os.path.join(data_path, 'top_desc_words.pkl'),
+    )
+    model.save(os.path.join(data_path, 'music_model.bin'))
+
+    start = time.perf_counter()
+    MusicVideoModel.read(os.path.join(data_path, 'music_model.bin')).vocabularies()
+    print(f"Model file loaded in {(time.perf_counter() - start) * 1000:.2f} ms")
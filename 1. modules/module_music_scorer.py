@@ -0,0 +1,149 @@
+r'''
+Scores how much a video looks like a music video, as an alternative to the three 0/1 checks.
+
+The three checks only say if a video has at least one top category, tag or description
+word, so a video with a single matching word passes as much as one with dozens. The scorer
+counts how many of them it has instead, each weighted by how common it is in the music playlist:
+    - The tags and description words of all the videos are hashed at once into a lookup
+    table of the reference vocabulary, and the hits are checked against the actual words,
+    so that a collision never counts as a match.
+    - The matches are put into a sparse CSR matrix with one row per video and one column
+    per word of the vocabulary.
+    - The scores of all the videos are a single sparse matrix-vector product with the
+    weights of the vocabulary, plus the weight of the category.
+
+Scores are then split into Y/N/Maybe with two thresholds that can be tuned (see
+module_triage_music_4.py). The default ones have only been checked against music videos
+(see create_song_db_2.py), not against videos that aren't music.
+'''
+
+from itertools import chain
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from module_triage_music_4 import score_codes, as_labels
+
+
+class MusicVideoScorer:
+    '''
+    Weighted score of the category, tags and description words of videos against a MusicVideoModel.
+    '''
+
+    def __init__(self, model, category_weight=2.0, tag_weight=1.0, description_weight=0.5,
+                 music_threshold=2.5, not_music_threshold=0.5, n_buckets=2**16):
+        '''
+        param model -> MusicVideoModel with the reference vocabularies and their counts.
+        param category_weight -> Score of a video in one of the top categories.
+        param tag_weight, description_weight -> Score of the most common tag/description word.
+        Less common words score less, in proportion to the log of their count.
+        param music_threshold -> Videos scoring at least this much are music.
+        param not_music_threshold -> Videos scoring less than this aren't music.
+        param n_buckets -> Initial size of the hash table of each vocabulary, doubled until
+        no two words of the vocabulary share a bucket.
+        '''
+        self.music_threshold = music_threshold
+        self.not_music_threshold = not_music_threshold
+        self.category_weight = category_weight
+        self.category_ids = list(map(int, model.category_ids))
+
+        # Columns of the matrix: the tags, then the description words.
+        self.tag_lookup, self.tags = MusicVideoScorer.build_lookup(model.tags, n_buckets)
+        self.desc_lookup, self.desc_words = MusicVideoScorer.build_lookup(model.desc_words, n_buckets)
+        self.weights = np.concatenate([
+            tag_weight * MusicVideoScorer.count_weights(model.tag_counts),
+            description_weight * MusicVideoScorer.count_weights(model.desc_counts),
+            ])
+
+    @staticmethod
+    def count_weights(counts):
+        '''
+        returns a weight in (0, 1] for every count, 1 for the largest one.
+        '''
+        counts = np.asarray(counts, dtype='float64')
+        if not len(counts):
+            return counts
+        return np.log1p(counts) / np.log1p(counts.max())
+
+    @staticmethod
+    def hash_words(words, n_buckets):
+        '''
+        returns the bucket of every word. The hash is stable across processes, unlike hash().
+        '''
+        return (pd.util.hash_array(np.asarray(words, dtype=object)) % np.uint64(n_buckets)).astype('int64')
+
+    @staticmethod
+    def build_lookup(vocabulary, n_buckets):
+        '''
+        returns a lookup table with the position of every word of the vocabulary in its bucket
+        (-1 for empty buckets), and the words as an array.
+        '''
+        vocabulary = np.asarray(vocabulary, dtype=object)
+        while True:
+            buckets = MusicVideoScorer.hash_words(vocabulary, n_buckets)
+            if len(np.unique(buckets)) == len(buckets):
+                break
+            n_buckets *= 2
+        lookup = np.full(n_buckets, -1, dtype='int64')
+        lookup[buckets] = np.arange(len(vocabulary))
+        return lookup, vocabulary
+
+    @staticmethod
+    def match_columns(all_words, lookup, vocabulary, lower=False):
+        '''
+        param all_words -> List of words of every video.
+        param lower -> Whether the words must be lower-cased first.
+
+        returns the row and column of every word that belongs to the vocabulary.
+        '''
+        all_words = list(all_words)
+        # All the words in a single array, along with the position of their video.
+        lengths = np.array([len(words) for words in all_words], dtype='int64')
+        rows = np.repeat(np.arange(len(all_words)), lengths)
+        words = chain.from_iterable(all_words)
+        words = np.array([word.lower() for word in words] if lower else list(words), dtype=object)
+        if not len(words):
+            return rows, rows
+
+        columns = lookup[MusicVideoScorer.hash_words(words, len(lookup))]
+        hits = np.flatnonzero(columns >= 0)
+        # Words sharing a bucket with a word of the vocabulary don't count.
+        hits = hits[words[hits] == vocabulary[columns[hits]]]
+        return rows[hits], columns[hits]
+
+    def feature_matrix(self, all_tags, all_desc_words):
+        '''
+        param all_tags -> List of tags of every video.
+        param all_desc_words -> List of lower-cased description words of every video.
+
+        returns a sparse CSR matrix with one row per video and one column per word of the
+        vocabulary, 1 where the video has the word.
+        '''
+        n_videos = len(all_tags)
+        tag_rows, tag_columns = MusicVideoScorer.match_columns(all_tags, self.tag_lookup, self.tags, lower=True)
+        desc_rows, desc_columns = MusicVideoScorer.match_columns(all_desc_words, self.desc_lookup, self.desc_words)
+        rows = np.concatenate([tag_rows, desc_rows])
+        columns = np.concatenate([tag_columns, desc_columns + len(self.tags)])
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, columns)), shape=(n_videos, len(self.weights))
+            )
+        # A word used several times by the same video counts once.
+        matrix.data[:] = 1
+        return matrix
+
+    def score(self, category_ids, all_tags, all_desc_words):
+        '''
+        param category_ids -> CategoryID of every video.
+        param all_tags -> List of tags of every video.
+        param all_desc_words -> List of lower-cased description words of every video.
+
+        returns the MusicScore of every video as a float array.
+        '''
+        category = pd.to_numeric(pd.Series(np.asarray(category_ids)), errors='coerce')
+        category_scores = self.category_weight * category.isin(self.category_ids).to_numpy()
+        return self.feature_matrix(all_tags, all_desc_words) @ self.weights + category_scores
+
+    def label(self, scores):
+        '''
+        returns a categorical of Y, Maybe or N for every score.
+        '''
+        return as_labels(score_codes(scores, self.music_threshold, self.not_music_threshold))
@@ -0,0 +1,56 @@
+r"""
+State kept between two runs of the pipeline.
+
+For incremental runs we record the latest WatchDate that has been processed (the
+high-water mark). On the next Takeout export, only the history newer than it needs to
+be parsed, fetched and classified, and the results are merged into the existing outputs.
+"""
+
+import os
+import json
+import pandas as pd
+
+
+class PipelineState:
+    """
+    Small JSON file holding the high-water mark of the processed history.
+    """
+
+    def __init__(self, state_path):
+        """
+        param state_path -> Path of the JSON file. A missing file means nothing has been
+        processed yet.
+        """
+        self.state_path = state_path
+        self.state = {}
+        if os.path.isfile(state_path):
+            with open(state_path, 'r', encoding='utf-8') as file:
+                self.state = json.load(file)
+
+    @property
+    def last_watch_date(self):
+        '''
+        Latest WatchDate processed so far as a UTC Timestamp, None before the first run.
+        '''
+        last_watch_date = self.state.get('last_watch_date')
+        return pd.Timestamp(last_watch_date) if last_watch_date else None
+
+    def update_last_watch_date(self, watch_dates):
+        '''
+        param watch_dates -> Series of the parsed WatchDates that have just been processed.
+
+        Moves the high-water mark forward (never backward) and saves the state.
+        '''
+        latest = watch_dates.max()
+        if pd.isna(latest):
+            return
+        if self.last_watch_date is None or latest > self.last_watch_date:
+            self.state['last_watch_date'] = latest.isoformat()
+            self.save()
+
+    def save(self):
+        # Writing to a temporary file first, so a crash never leaves a truncated state.
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.state, file, indent=2)
+        os.replace(temp_path, self.state_path)
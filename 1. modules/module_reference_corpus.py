@@ -0,0 +1,140 @@
+r'''
+Builds the reference corpus: the details of the videos of playlists of ONLY MUSIC videos,
+from which how_to_identify_a_music_video.py learns the reference vocabularies.
+
+Any number of playlists can be given, e.g. one per genre, to widen the reference set:
+    - The playlists are paged through on a thread dedicated to it, and the details of the
+    50 videos of a page are requested on a pool of worker threads as soon as the page
+    arrives, so paging through the playlists overlaps with fetching the details of their videos.
+    - The VideoIDs of every playlist and the details of every video are stored in a
+    VideoDetailsCache as they arrive, so a rerun only requests what it hasn't seen before,
+    and a run that was interrupted resumes where it stopped.
+
+The requests share the rate limit and retries of FetchVideoDetails.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from module_fetch_video_details_2 import FetchVideoDetails, QuotaExhausted
+
+
+class ReferenceCorpusBuilder:
+    '''
+    Fetches the details of every video of a list of playlists.
+    '''
+
+    # The API returns at most 50 playlist items per page.
+    page_size = 50
+
+    def __init__(self, YT_build, playlist_ids, cache=None, max_workers=8, requests_per_sec=None):
+        '''
+        param YT_build -> YouTube API resource
+        param playlist_ids -> IDs of the playlists of music videos.
+        param cache -> VideoDetailsCache holding the playlist items and video details
+        already fetched, None to fetch everything.
+        param max_workers -> Maximum number of video details requests in flight, on top of the
+        request of the pagination thread.
+        param requests_per_sec -> Rate limit on the requests sent to the API, None for no limit.
+        '''
+        self.YT_build = YT_build
+        self.playlist_ids = list(dict.fromkeys(playlist_ids))
+        self.cache = cache
+        self.max_workers = max_workers
+        # The pagination thread and the workers send requests at the same time, whatever
+        # the number of workers, so each of them needs an HTTP object of its own.
+        self.fetcher = FetchVideoDetails(
+            YT_build, None, max_workers=max_workers, requests_per_sec=requests_per_sec,
+            cache=cache, per_thread_http=True,
+            )
+        # False after build if the quota ran out before every playlist and video was fetched.
+        self.complete = True
+
+    def playlist_pages(self, playlist_id):
+        '''
+        Yields the VideoIDs of every page of the playlist, from the cache if it's there.
+        The playlist is cached once all its pages have been fetched.
+        '''
+        video_ids = self.cache.get_playlist(playlist_id) if self.cache is not None else None
+        if video_ids is not None:
+            for limit in range(0, len(video_ids), self.page_size):
+                yield video_ids[limit : limit + self.page_size]
+            return
+
+        video_ids = []
+        page_token = None
+        while True:
+            request = self.YT_build.playlistItems().list(
+                part='contentDetails',
+                playlistId=playlist_id,
+                maxResults=self.page_size,
+                pageToken=page_token
+                )
+            try:
+                response = self.fetcher.execute(request)
+            except QuotaExhausted:
+                self.complete = False
+                return
+            page_ids = [item['contentDetails'].get('videoId') for item in response.get('items', [])]
+            page_ids = [yt_id for yt_id in page_ids if yt_id]
+            video_ids += page_ids
+            yield page_ids
+
+            # Returns None once we have exhausted all pages.
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+        if self.cache is not None:
+            self.cache.put_playlist(playlist_id, video_ids)
+
+    def fetch_page(self, video_ids):
+        '''
+        param video_ids -> VideoIDs of a page of a playlist.
+
+        returns the details of the videos of the page that are still available, the cached
+        ones included.
+        '''
+        cached = self.cache.get_many(video_ids) if self.cache is not None else {}
+        ids_to_fetch = [yt_id for yt_id in dict.fromkeys(video_ids) if yt_id not in cached]
+        fetched = self.fetcher.fetch_batch(ids_to_fetch) if ids_to_fetch else []
+        if fetched is None:
+            self.complete = False
+            fetched = []
+        details_by_id = {yt_id: details for yt_id, details in cached.items() if details is not None}
+        details_by_id.update((details['VideoID'], details) for details in fetched)
+        return [details_by_id[yt_id] for yt_id in video_ids if yt_id in details_by_id]
+
+    def fetch_playlist(self, playlist_id, executor):
+        '''
+        Pages through the playlist, handing every page to executor as soon as it arrives.
+
+        returns the futures of the details of every page, in order.
+        '''
+        return [executor.submit(self.fetch_page, page_ids) for page_ids in self.playlist_pages(playlist_id)]
+
+    def build(self):
+        '''
+        returns a dataframe of the details of every video of the playlists, each video once,
+        in the order of the playlists.
+        '''
+        self.complete = True
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Paging through the playlists one after the other on a thread of its own, which
+            # never waits for a details request.
+            with ThreadPoolExecutor(max_workers=1) as pager:
+                all_futures = pager.submit(
+                    lambda: [self.fetch_playlist(playlist_id, executor) for playlist_id in self.playlist_ids]
+                    ).result()
+            all_video_details = [
+                details for futures in all_futures for future in futures for details in future.result()
+                ]
+
+        df = pd.DataFrame(
+            all_video_details,
+            columns=[
+                'VideoID', 'Title', 'CategoryID', 'PublishDate',
+                'ChannelTitle', 'Duration', 'Description', 'Tags',
+                ],
+            )
+        # A video can be in several playlists.
+        return df.drop_duplicates(subset=['VideoID'], ignore_index=True)
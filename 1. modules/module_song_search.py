@@ -0,0 +1,291 @@
+r'''
+Search over the songs of the music database, without loading the database.
+
+An inverted index is kept in a SQLite database: for every word, the songs it appears in and
+how often, weighted by where it appears (Title, Tags, ChannelTitle or Description). The words
+are split with the DescriptionTokenizer used to classify the videos, and the punctuation
+around them is dropped.
+    - A query counts the songs of every word, a range scan of the primary key per word,
+    then scores and ranks the songs with BM25 in a single SQL query.
+    - With prefix=True, the last word of the query also matches every word starting with
+    it, through a range query over the sorted words.
+    - Songs are added or updated incrementally: a song whose fields haven't changed since
+    it was indexed isn't tokenized again.
+'''
+
+import sys
+import math
+import time
+import string
+import random
+import sqlite3
+import hashlib
+import threading
+import pandas as pd
+from itertools import chain
+from collections import Counter, namedtuple
+from nltk.corpus import stopwords
+from module_description_tokenizer import DescriptionTokenizer
+from module_storage import as_list
+
+
+# A song matching a query.
+SearchResult = namedtuple('SearchResult', ['VideoID', 'Title', 'ChannelTitle', 'Score'])
+
+
+class SongSearchIndex:
+    '''
+    Inverted index of the Title, Tags, ChannelTitle and Description of songs, backed by SQLite.
+    '''
+
+    # Weight of a word in every field, the Title tells the most about a song.
+    field_weights = {'Title': 3.0, 'Tags': 2.0, 'ChannelTitle': 2.0, 'Description': 1.0}
+    # BM25 parameters: saturation of the term frequency, and normalization by song length.
+    k1 = 1.2
+    b = 0.75
+    # Number of words a prefix expands to at most, the most common ones.
+    max_prefix_terms = 100
+
+    def __init__(self, db_path, stop_words=None):
+        '''
+        param db_path -> Path of the SQLite database, created if it doesn't exist.
+        param stop_words -> Words that aren't indexed, the english stopwords by default.
+        '''
+        self.db_path = db_path
+        self.tokenizer = DescriptionTokenizer((), stopwords.words('english') if stop_words is None else stop_words)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS songs ("
+                "SongID INTEGER PRIMARY KEY, VideoID TEXT UNIQUE NOT NULL, Title TEXT, "
+                "ChannelTitle TEXT, Length REAL NOT NULL, Hash TEXT NOT NULL)"
+            )
+            # Keyed by word first, the postings of a word (or of all the words starting
+            # with a prefix) are a single range of the primary key. The Length of the song
+            # is repeated in every posting, so that scoring never reads the songs.
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS postings ("
+                "Term TEXT NOT NULL, SongID INTEGER NOT NULL, TF REAL NOT NULL, Length REAL NOT NULL, "
+                "PRIMARY KEY (Term, SongID)) WITHOUT ROWID"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS postings_song ON postings (SongID)")
+            # Number of songs and their total length, kept up to date by every update so that
+            # a query never scans the songs.
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS corpus ("
+                "ID INTEGER PRIMARY KEY CHECK (ID = 0), NSongs INTEGER NOT NULL, TotalLength REAL NOT NULL)"
+            )
+            # Only when the database is new: every update keeps the corpus up to date, and
+            # opening the index to search it leaves the file unchanged.
+            if self.connection.execute("SELECT COUNT(*) FROM corpus").fetchone()[0] == 0:
+                self.update_corpus()
+
+    def update_corpus(self):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO corpus (ID, NSongs, TotalLength) "
+            "SELECT 0, COUNT(*), TOTAL(Length) FROM songs"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT NSongs FROM corpus").fetchone()[0]
+
+    def video_ids(self):
+        '''
+        returns the set of VideoIDs of the songs in the index.
+        '''
+        with self.lock:
+            return {video_id for (video_id,) in self.connection.execute("SELECT VideoID FROM songs")}
+
+    def tokenize(self, text):
+        '''
+        returns the words of the text, lower-cased, without stopwords and the punctuation around them.
+        '''
+        words = (word.strip(string.punctuation) for word in self.tokenizer.tokenize(text))
+        return [word for word in words if word and word not in self.tokenizer.stop_words]
+
+    def song_terms(self, song):
+        '''
+        param song -> Row of the music database with its Title, Tags, ChannelTitle and
+        Description (either a text or the list of its words).
+
+        returns a Counter of the weighted frequency of every word of the song.
+        '''
+        terms = Counter()
+        for field, weight in SongSearchIndex.field_weights.items():
+            value = song.get(field)
+            # Tags and tokenized Descriptions are lists of words, the rest are texts.
+            if value is not None and not isinstance(value, (str, float)):
+                value = ' '.join(as_list(value))
+            for word in self.tokenize(value):
+                terms[word] += weight
+        return terms
+
+    def add_songs(self, df_songs):
+        '''
+        param df_songs -> Dataframe of songs with their VideoID, Title, Tags, ChannelTitle
+        and Description.
+
+        Indexes the new songs and the songs that have changed, returns their number. Raises
+        a ValueError if one of the fields is missing, rather than indexing the songs without it.
+        '''
+        missing_fields = [field for field in SongSearchIndex.field_weights if field not in df_songs.columns]
+        if missing_fields:
+            raise ValueError(f"The songs to index have no {', '.join(missing_fields)} column.")
+        with self.lock:
+            indexed = {
+                video_id: (song_id, song_hash) for video_id, song_id, song_hash
+                in self.connection.execute("SELECT VideoID, SongID, Hash FROM songs")
+                }
+        columns = ['VideoID', *SongSearchIndex.field_weights]
+        songs, postings = [], []
+        for song in df_songs[columns].drop_duplicates(subset=['VideoID'], keep='last').to_dict('records'):
+            # Songs whose fields haven't changed since they were indexed are skipped.
+            song_hash = hashlib.sha1(repr(sorted(song.items())).encode('utf-8')).hexdigest()
+            song_id, indexed_hash = indexed.get(song['VideoID'], (None, None))
+            if indexed_hash == song_hash:
+                continue
+            terms = self.song_terms(song)
+            songs.append((song_id, song['VideoID'], song.get('Title'), song.get('ChannelTitle'), sum(terms.values()), song_hash))
+            postings.append(terms)
+
+        with self.lock, self.connection:
+            # The old postings of the songs that have changed are replaced.
+            self.connection.executemany(
+                "DELETE FROM postings WHERE SongID = ?", [(song[0],) for song in songs if song[0] is not None]
+                )
+            rows = []
+            for song, terms in zip(songs, postings):
+                song_id = self.connection.execute(
+                    "INSERT OR REPLACE INTO songs (SongID, VideoID, Title, ChannelTitle, Length, Hash) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    song,
+                    ).lastrowid
+                rows += [(term, song_id, tf, song[4]) for term, tf in terms.items()]
+            # Inserted in the order of the primary key, the postings are appended to the index.
+            rows.sort()
+            self.connection.executemany("INSERT INTO postings (Term, SongID, TF, Length) VALUES (?, ?, ?, ?)", rows)
+            self.update_corpus()
+        return len(songs)
+
+    def remove_songs(self, video_ids):
+        '''
+        Removes the songs with these VideoIDs from the index.
+        '''
+        with self.lock, self.connection:
+            for video_id in video_ids:
+                self.connection.execute(
+                    "DELETE FROM postings WHERE SongID IN (SELECT SongID FROM songs WHERE VideoID = ?)", (video_id,)
+                    )
+                self.connection.execute("DELETE FROM songs WHERE VideoID = ?", (video_id,))
+            self.update_corpus()
+
+    @staticmethod
+    def prefix_end(prefix):
+        '''
+        returns the smallest string greater than every string starting with prefix.
+        '''
+        return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def document_frequencies(self, term, prefix=False):
+        '''
+        returns a list of (word, number of songs it appears in) for the term. With prefix=True,
+        for the max_prefix_terms most common words starting with it.
+
+        Only the primary key of the postings is read, never the postings themselves.
+        '''
+        if prefix:
+            return self.connection.execute(
+                "SELECT Term, COUNT(*) AS DF FROM postings WHERE Term >= ? AND Term < ? "
+                "GROUP BY Term ORDER BY DF DESC, Term LIMIT ?",
+                (term, SongSearchIndex.prefix_end(term), self.max_prefix_terms),
+                ).fetchall()
+        return self.connection.execute(
+            "SELECT Term, COUNT(*) FROM postings WHERE Term = ? GROUP BY Term", (term,)
+            ).fetchall()
+
+    def search(self, query, k=10, prefix=False):
+        '''
+        param query -> Words to look for.
+        param k -> Number of songs to return.
+        param prefix -> Whether the last word of the query also matches the words starting with it.
+
+        returns a list of the SearchResult of the k songs that best match the query, best first.
+        '''
+        query_terms = list(dict.fromkeys(self.tokenize(query)))
+        if not query_terms:
+            return []
+
+        with self.lock:
+            n_songs, total_length = self.connection.execute("SELECT NSongs, TotalLength FROM corpus").fetchone()
+            # Inverse document frequency of every word looked for.
+            idfs = {}
+            for position, term in enumerate(query_terms):
+                for word, df in self.document_frequencies(term, prefix and position == len(query_terms) - 1):
+                    idfs[word] = math.log(1 + (n_songs - df + 0.5) / (df + 0.5))
+            if not idfs:
+                return []
+
+            # The postings of the words are scored and ranked by SQLite, in a single query.
+            # BM25 normalizes the TF by k1 * (1 - b + b * Length / average length).
+            average_length = total_length / n_songs
+            rows = self.connection.execute(
+                f"WITH query (Term, IDF) AS (VALUES {','.join(['(?, ?)'] * len(idfs))}), "
+                "top_songs AS ("
+                "SELECT SongID, SUM(IDF * TF * ? / (TF + ? + ? * Length)) AS Score "
+                "FROM query JOIN postings USING (Term) GROUP BY SongID ORDER BY Score DESC, SongID LIMIT ?) "
+                "SELECT VideoID, Title, ChannelTitle, Score FROM top_songs JOIN songs USING (SongID) "
+                "ORDER BY Score DESC, SongID",
+                [*chain.from_iterable(idfs.items()),
+                 self.k1 + 1, self.k1 * (1 - self.b), self.k1 * self.b / average_length, k],
+                ).fetchall()
+        return [SearchResult(*row) for row in rows]
+
+###############################################################################
+
+def benchmark_search(db_path, n_songs=50000, n_queries=1000):
+    '''
+    Times the indexing of n_songs synthetic songs into a new index at db_path, and
+    keyword and prefix queries over it.
+    '''
+    rng = random.Random(23)
+    vocabulary = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(20000)]
+    df_songs = pd.DataFrame({
+        'VideoID': [f'{song:011d}' for song in range(n_songs)],
+        'Title': [' '.join(rng.choices(vocabulary, k=5)) for _ in range(n_songs)],
+        'ChannelTitle': [rng.choice(vocabulary[:2000]) for _ in range(n_songs)],
+        'Tags': [rng.choices(vocabulary, k=8) for _ in range(n_songs)],
+        'Description': [rng.choices(vocabulary, k=40) for _ in range(n_songs)],
+        })
+    with SongSearchIndex(db_path) as index:
+        start = time.perf_counter()
+        index.add_songs(df_songs)
+        print(f"Indexed {n_songs} songs in {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        n_updated = index.add_songs(df_songs)
+        print(f"Checked them again in {time.perf_counter() - start:.2f}s, {n_updated} updated")
+
+        for prefix in (False, True):
+            queries = [
+                ' '.join(rng.choice(vocabulary)[:3 if prefix else None] for _ in range(2)) for _ in range(n_queries)
+                ]
+            start = time.perf_counter()
+            for query in queries:
+                index.search(query, prefix=prefix)
+            elapsed = (time.perf_counter() - start) / n_queries
+            print(f"{'Prefix' if prefix else 'Keyword'} queries: {elapsed * 1000:.3f} ms each")
+
+
+if __name__ == '__main__':
+    benchmark_search(sys.argv[1] if len(sys.argv) > 1 else 'SongSearchIndex_benchmark.sqlite')
@@ -0,0 +1,204 @@
+r'''
+Runs the stages of the pipeline as a dependency graph, and only the ones that are out of date.
+
+Every stage reads some files (its inputs), takes some parameters and writes some files (its
+outputs). A stage depends on the stages writing its inputs. Once a stage has run, its key is
+recorded in a JSON manifest: a hash of its parameters and of the content of its inputs. A stage
+is run again only if:
+    - its key has changed, i.e. one of its inputs or parameters has changed,
+    - or one of its outputs is missing or has been changed since it was written.
+Since the keys hash what the inputs contain, a stage that runs again but writes the same
+outputs as before doesn't make the stages after it run again.
+
+Hashing a large file takes a while, so the hash of every file is kept in the manifest along
+with its size and modification time, and only files that have been modified are hashed again.
+'''
+
+import os
+import json
+import hashlib
+from collections import namedtuple
+
+# A stage of the pipeline: run(**params) reads the inputs and writes the outputs.
+Stage = namedtuple('Stage', ['name', 'run', 'inputs', 'outputs', 'params'])
+
+
+class StageGraph:
+    '''
+    Stages of the pipeline, in the order they run, and the manifest of the ones that have run.
+    '''
+
+    def __init__(self, manifest_path):
+        '''
+        param manifest_path -> Path of the JSON manifest. A missing file means no stage has run yet.
+        '''
+        self.manifest_path = manifest_path
+        self.root = os.path.dirname(os.path.abspath(manifest_path))
+        self.stages = {}
+        self.manifest = {'files': {}, 'stages': {}}
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as file:
+                self.manifest = json.load(file)
+
+    def relative(self, path):
+        '''
+        returns path relative to the directory of the manifest, the same wherever the pipeline runs from.
+        '''
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, '/')
+
+    def add(self, name, run, inputs=(), outputs=(), params=None):
+        '''
+        param name -> Name of the stage.
+        param run -> Function of the stage, called with the params.
+        param inputs -> Paths of the files the stage reads. Missing files are allowed, e.g.
+        a sheet that is only there once the user has written it.
+        param outputs -> Paths of the files the stage writes.
+        param params -> Dictionary of the parameters of the stage, which must be JSON serializable.
+
+        Stages are added in the order they run: the stages writing the inputs of a stage
+        must have been added before it.
+        '''
+        stage = Stage(
+            name, run, [self.relative(path) for path in inputs], [self.relative(path) for path in outputs], params or {}
+            )
+        if name in self.stages:
+            raise ValueError(f"There already is a stage called {name}.")
+        read_by_stages = {path for other in self.stages.values() for path in other.inputs}
+        for output in stage.outputs:
+            if output in self.written_by_stages():
+                raise ValueError(f"{output} is written by two stages.")
+            if output in read_by_stages or output in stage.inputs:
+                raise ValueError(f"{output} is written by stage {name}, after a stage reading it.")
+        self.stages[name] = stage
+        return stage
+
+    def written_by_stages(self):
+        return {output for stage in self.stages.values() for output in stage.outputs}
+
+    def dependencies(self, name):
+        '''
+        returns the names of the stages writing the inputs of the stage.
+        '''
+        inputs = set(self.stages[name].inputs)
+        return [other.name for other in self.stages.values() if inputs.intersection(other.outputs)]
+
+    def upstream(self, names):
+        '''
+        returns the names of the stages and of every stage they depend on, in the order they run.
+        '''
+        unknown = set(names) - set(self.stages)
+        if unknown:
+            raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}. The stages are: {', '.join(self.stages)}.")
+        needed = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending += self.dependencies(name)
+        return [name for name in self.stages if name in needed]
+
+    def file_digest(self, path):
+        '''
+        param path -> Path relative to the manifest.
+
+        returns the sha1 of the content of the file, None if it doesn't exist. The hash of a
+        file whose size and modification time haven't changed is taken from the manifest.
+        A directory (e.g. a table stored in parts) is hashed from the names and hashes of its files.
+        '''
+        full_path = os.path.join(self.root, path)
+        if os.path.isdir(full_path):
+            sha1 = hashlib.sha1()
+            for name in sorted(os.listdir(full_path)):
+                sha1.update(f"{name}:{self.file_digest(f'{path}/{name}')};".encode('utf-8'))
+            return sha1.hexdigest()
+        if not os.path.isfile(full_path):
+            return None
+        stat = os.stat(full_path)
+        known = self.manifest['files'].get(path)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['sha1']
+        sha1 = hashlib.sha1()
+        with open(full_path, 'rb') as file:
+            for block in iter(lambda: file.read(2**20), b''):
+                sha1.update(block)
+        self.manifest['files'][path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': sha1.hexdigest()}
+        return sha1.hexdigest()
+
+    def stage_key(self, stage):
+        '''
+        returns the hash of the parameters of the stage and of the content of its inputs.
+        '''
+        key = {
+            'stage': stage.name,
+            'params': stage.params,
+            'inputs': {path: self.file_digest(path) for path in stage.inputs},
+            }
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def outdated(self, stage):
+        '''
+        returns why the stage must run, None if it's up to date.
+        '''
+        recorded = self.manifest['stages'].get(stage.name)
+        if recorded is None:
+            return "never run"
+        if recorded['key'] != self.stage_key(stage):
+            return "inputs or parameters changed"
+        for path in stage.outputs:
+            if self.file_digest(path) != recorded['outputs'].get(path):
+                return f"{path} missing or changed"
+        return None
+
+    def run(self, targets=None, force=()):
+        '''
+        param targets -> Names of the stages to bring up to date, along with the stages they
+        depend on. All of them by default.
+        param force -> Names of stages to run even if they are up to date.
+
+        Runs the stages that are out of date, in order, and returns their names. The manifest
+        is saved after every stage, so the stages that have run stay recorded if a later one fails.
+        '''
+        unknown = set(force) - set(self.stages)
+        if unknown:
+            raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}. The stages are: {', '.join(self.stages)}.")
+        ran = []
+        for name in self.upstream(targets or list(self.stages)):
+            stage = self.stages[name]
+            reason = "forced" if name in force else self.outdated(stage)
+            if reason is None:
+                print(f"[{name}] up to date, skipped.")
+                continue
+            print(f"[{name}] running ({reason})...")
+            key = self.stage_key(stage)
+            stage.run(**stage.params)
+            self.manifest['stages'][name] = {
+                'key': key,
+                'outputs': {path: self.file_digest(path) for path in stage.outputs},
+                }
+            self.save()
+            ran.append(name)
+        return ran
+
+    def plan(self, targets=None, force=()):
+        '''
+        returns the (name, why it must run) of the stages run() would run. The stages after a
+        stage that must run are listed as well, since its outputs may change.
+        '''
+        planned = []
+        for name in self.upstream(targets or list(self.stages)):
+            stage = self.stages[name]
+            changed = [dependency for dependency, _ in planned if dependency in self.dependencies(name)]
+            reason = "forced" if name in force else self.outdated(stage)
+            if reason is None and changed:
+                reason = f"if {', '.join(changed)} changes its outputs"
+            if reason is not None:
+                planned.append((name, reason))
+        return planned
+
+    def save(self):
+        # Writing to a temporary file first, so a crash never leaves a truncated manifest.
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.manifest, file, indent=2, sort_keys=True)
+        os.replace(temp_path, self.manifest_path)
@@ -0,0 +1,237 @@
+r'''
+Storage of the tables handed from one stage of the pipeline to the next.
+
+Every table can be stored in one of two formats, chosen by the extension of its path:
+    - parquet: columnar and compressed. The Tags and Description lists stay lists, the
+    dates stay timestamps and the categoricals stay categoricals, and only the columns
+    asked for are read.
+    - csv: readable in a spreadsheet. The lists are written as their repr and the dates
+    as strings, both are parsed back on reading.
+
+Parquet files can't be appended to: once rows are appended to a parquet table (e.g. the
+watch events of an incremental run), its path becomes a directory of part-*.parquet files,
+read back as a single table.
+
+stage_formats sets the format of every stage, and stage_path gives its path. memory_report
+shows how much memory the tables of the stages it is given take (pipeline.py reports all of them).
+'''
+
+import os
+import ast
+import glob
+import numpy as np
+import pandas as pd
+
+# Format each stage of the pipeline is stored in: 'parquet' or 'csv'.
+stage_formats = {
+    'WatchedURLs': 'parquet',
+    'WatchEvents': 'parquet',
+    'WatchedURLs_allDetails': 'parquet',
+    'InitialMusicDatabase': 'parquet',
+    'TriagedMusicDatabase': 'parquet',
+    'FinalMusicDATABASE': 'parquet',
+    'WordFrequencies': 'parquet',
+}
+
+# Columns that can hold a list of words for every video (the Description only once it's
+# been split into words), and columns holding dates.
+list_columns = ('Tags', 'Description')
+date_columns = ('WatchDate', 'FirstSeen', 'LastSeen')
+
+
+def as_list(value):
+    '''
+    param value -> A list, an array read from parquet, None/nan/blank if there's nothing,
+    or the repr of a list read from a csv or excel file.
+
+    returns the value as a list.
+    '''
+    if isinstance(value, list):
+        return value
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, str) and value.startswith('['):
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            # Text that only looks like a list, e.g. a title like "[Official Video]".
+            return [value]
+    return []
+
+
+def holds_lists(values):
+    '''
+    returns True if the column holds lists: lists or arrays in memory or in a parquet file,
+    reprs of lists in a csv file. Blanks stand for empty lists.
+    '''
+    if values.dtype != object:
+        return False
+    if any(isinstance(value, (list, np.ndarray)) for value in values):
+        return True
+    values = values.dropna().astype(str).str.strip()
+    return len(values) > 0 and (values.str.startswith('[') | (values == '')).all()
+
+
+def list_columns_of(df):
+    return [column for column in list_columns if column in df.columns and holds_lists(df[column])]
+
+
+def stage_path(directory, stage):
+    '''
+    returns the path of the table of the stage in directory, with the extension of its format.
+    '''
+    return os.path.join(directory, f"{stage}.{stage_formats.get(stage, 'parquet')}")
+
+
+def table_paths(path):
+    '''
+    returns path and the path of the same table in the other format.
+    '''
+    stem, extension = os.path.splitext(path)
+    return [path, stem + ('.csv' if extension == '.parquet' else '.parquet')]
+
+
+def existing_path(path):
+    '''
+    returns path, or the path of the same table in the other format if only that one
+    exists (e.g. written before the format of the stage was changed).
+    '''
+    if os.path.exists(path):
+        return path
+    other_path = table_paths(path)[1]
+    return other_path if os.path.exists(other_path) else path
+
+
+def table_exists(path):
+    return os.path.exists(existing_path(path))
+
+
+def part_paths(path):
+    '''
+    returns the paths of the parts of the parquet table at path, in the order they were written.
+    '''
+    return sorted(glob.glob(os.path.join(path, 'part-*.parquet')))
+
+
+def remove_table(path):
+    '''
+    Removes the table at path, a file or a directory of parts.
+    '''
+    if os.path.isdir(path):
+        for part_path in part_paths(path):
+            os.remove(part_path)
+        os.rmdir(path)
+    elif os.path.isfile(path):
+        os.remove(path)
+
+
+def read_table(path, columns=None):
+    '''
+    param path -> Path of a parquet or csv table, or of a directory of parquet parts.
+    param columns -> Columns to read, all of them by default.
+
+    returns the table as a Dataframe with list columns as lists and dates as UTC timestamps.
+    '''
+    path = existing_path(path)
+    if path.endswith('.csv'):
+        df = pd.read_csv(path, usecols=columns, dtype={'VideoID': str})
+        for column in date_columns:
+            if column in df.columns:
+                df[column] = pd.to_datetime(df[column], utc=True)
+    else:
+        df = pd.read_parquet(path, columns=columns)
+    for column in list_columns_of(df):
+        df[column] = df[column].map(as_list)
+    return df
+
+
+def write_table(df, path):
+    '''
+    param df -> Dataframe to store.
+    param path -> Path of the table, its extension sets the format.
+    '''
+    # A list column holds lists only, whatever stood for "no tags" before.
+    columns_of_lists = list_columns_of(df)
+    df = df.assign(**{column: df[column].map(as_list) for column in columns_of_lists})
+    if path.endswith('.csv'):
+        df.to_csv(path, index=False, encoding='utf-8')
+    else:
+        # A parquet column holds a single type. Columns mixing them (e.g. a CategoryID fetched
+        # from the API and read back from an excel sheet) are stored as text.
+        for column in df.select_dtypes(object).columns.difference(columns_of_lists):
+            if pd.api.types.infer_dtype(df[column], skipna=True).startswith('mixed'):
+                df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+        # A table made of parts (see append_table) is replaced by a single file.
+        if os.path.isdir(path):
+            remove_table(path)
+        df.to_parquet(path, index=False, compression='zstd')
+
+
+def append_table(df, path):
+    '''
+    Adds the rows of df at the end of the table at path, created if it doesn't exist.
+    A parquet table becomes a directory of parts, and the rows are written as a new part
+    instead of writing the whole table again.
+    '''
+    if not table_exists(path):
+        write_table(df, path)
+    elif existing_path(path).endswith('.csv'):
+        df.to_csv(existing_path(path), mode='a', header=False, index=False, encoding='utf-8')
+    else:
+        path = existing_path(path)
+        if os.path.isfile(path):
+            # The table written as a single file becomes the first part.
+            temp_path = path + '.tmp'
+            os.replace(path, temp_path)
+            os.mkdir(path)
+            os.replace(temp_path, os.path.join(path, 'part-00000.parquet'))
+        write_table(df, os.path.join(path, f"part-{len(part_paths(path)):05d}.parquet"))
+
+
+def as_excel_sheet(df):
+    '''
+    returns df with its list columns written as the repr of the lists and its dates without
+    time zone, which excel cells can't hold.
+    '''
+    df = df.assign(**{column: df[column].map(repr) for column in list_columns_of(df)})
+    for column in df.select_dtypes('datetimetz').columns:
+        df[column] = df[column].dt.tz_localize(None)
+    return df
+
+
+def memory_usage_mb(df, generic=False):
+    '''
+    returns the memory used by df in MB, or with generic=True, the memory it would use with
+    generic dtypes: objects instead of categoricals and 64 bits for every number.
+    '''
+    total = df.index.memory_usage()
+    for column in df.columns:
+        values = df[column]
+        if generic and isinstance(values.dtype, pd.CategoricalDtype):
+            total += values.astype(object).memory_usage(index=False, deep=True)
+        elif generic and values.dtype.kind in 'biuf':
+            total += 8 * len(values)
+        else:
+            total += values.memory_usage(index=False, deep=True)
+    return total / 2**20
+
+
+def memory_report(tables):
+    '''
+    param tables -> Dictionary with key: stage and value: its dataframe, or the path of its
+    table to read it from.
+
+    returns a report of the memory used by every stage, and what it would use with generic dtypes.
+    '''
+    lines = ["Memory usage per stage:"]
+    for stage, df in tables.items():
+        if isinstance(df, str):
+            if not table_exists(df):
+                lines.append(f"  {stage}: not written yet")
+                continue
+            df = read_table(df)
+        lines.append(
+            f"  {stage}: {len(df)} rows, {memory_usage_mb(df):.1f} MB "
+            f"({memory_usage_mb(df, generic=True):.1f} MB with generic dtypes)"
+        )
+    return '\n'.join(lines)
@@ -0,0 +1,115 @@
+r'''
+This is the fourth module of the project: it sorts the videos kept by IdentifyMusicVideo
+into three groups:
+    - Y: definitely music. YouTube assigns Category 10 to music videos, so a video in
+    Category 10 or passing all three checks is music.
+    - N: definitely not music, the video fails all three checks.
+    - Maybe: everything else, to be checked manually.
+
+With a MusicVideoScorer, the groups come from the MusicScore and two thresholds instead.
+
+The labels are computed with array operations over whole columns and returned as a
+categorical, and the three groups are split off in the same call.
+'''
+
+import time
+import numpy as np
+import pandas as pd
+
+# Codes of the categorical labels.
+triage_dtype = pd.CategoricalDtype(['Y', 'Maybe', 'N'])
+MUSIC, MAYBE, NOT_MUSIC = 0, 1, 2
+
+
+def triage_codes(category_ids, category_check, tags_check, description_check):
+    '''
+    param category_ids -> CategoryID of every video, as numbers or strings.
+    param category_check, tags_check, description_check -> The 0/1 checks of every video.
+
+    returns the code of the label of every video as an int8 array.
+    '''
+    category_ids = np.asarray(category_ids)
+    if category_ids.dtype.kind not in 'iuf':
+        category_ids = pd.to_numeric(category_ids, errors='coerce')
+    n_checks = (
+        np.asarray(category_check, dtype='int8')
+        + np.asarray(tags_check, dtype='int8')
+        + np.asarray(description_check, dtype='int8')
+        )
+    codes = np.full(len(n_checks), MAYBE, dtype='int8')
+    codes[n_checks == 0] = NOT_MUSIC
+    codes[(category_ids == 10) | (n_checks == 3)] = MUSIC
+    return codes
+
+
+def score_codes(scores, music_threshold, not_music_threshold):
+    '''
+    param scores -> MusicScore of every video.
+
+    returns the code of the label of every video as an int8 array: music from
+    music_threshold on, not music below not_music_threshold.
+    '''
+    scores = np.asarray(scores)
+    codes = np.full(len(scores), MAYBE, dtype='int8')
+    codes[scores < not_music_threshold] = NOT_MUSIC
+    codes[scores >= music_threshold] = MUSIC
+    return codes
+
+
+def as_labels(codes):
+    '''
+    returns the codes as a categorical of Y, Maybe and N.
+    '''
+    return pd.Categorical.from_codes(codes, dtype=triage_dtype)
+
+
+def partition(df, codes):
+    '''
+    param df -> Dataframe of videos.
+    param codes -> Code of the label of every row of df.
+
+    returns the rows of df labelled Y, Maybe and N, each in their original order.
+    '''
+    codes = np.asarray(codes)
+    return tuple(df.take(np.flatnonzero(codes == code)) for code in (MUSIC, MAYBE, NOT_MUSIC))
+
+
+def triage_music(df_init_db, scorer=None):
+    '''
+    param df_init_db -> Dataframe of the videos kept by IdentifyMusicVideo, with their CategoryID
+    and checks (and their MusicScore when using a scorer).
+    param scorer -> MusicVideoScorer whose thresholds split the MusicScore, None to use the checks.
+
+    returns df_init_db with an Is_Music categorical column, and its Y, Maybe and N rows.
+    '''
+    if scorer is None:
+        codes = triage_codes(
+            df_init_db['CategoryID'], df_init_db['CategoryCheck'],
+            df_init_db['TagsCheck'], df_init_db['DescriptionCheck'],
+            )
+    else:
+        codes = score_codes(df_init_db['MusicScore'], scorer.music_threshold, scorer.not_music_threshold)
+    df_init_db = df_init_db.assign(Is_Music=as_labels(codes))
+    return (df_init_db, *partition(df_init_db, codes))
+
+###############################################################################
+
+def benchmark_triage_music(size=10000000):
+    '''
+    Times triage_music on a synthetic initial database of size rows.
+    '''
+    rng = np.random.default_rng(23)
+    df = pd.DataFrame({
+        'CategoryID': rng.choice(np.array([10, 24, 22, 20, 27], dtype='int64'), size),
+        'CategoryCheck': rng.integers(0, 2, size, dtype='int8'),
+        'TagsCheck': rng.integers(0, 2, size, dtype='int8'),
+        'DescriptionCheck': rng.integers(0, 2, size, dtype='int8'),
+        })
+    start = time.perf_counter()
+    df, music, maybe, not_music = triage_music(df)
+    elapsed = time.perf_counter() - start
+    print(f"{size} videos triaged in {elapsed:.2f}s: {len(music)} Y, {len(maybe)} Maybe, {len(not_music)} N")
+
+
+if __name__ == '__main__':
+    benchmark_triage_music()
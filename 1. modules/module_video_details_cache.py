@@ -0,0 +1,120 @@
+r"""
+Local cache of the video details fetched from the YouTube API.
+
+Every VideoID is stored in a SQLite database along with its details and the time at
+which they were fetched. FetchVideoDetails looks the IDs up here first and only sends
+the misses to the API, so rerunning the pipeline on a new Takeout export costs quota
+only for the videos we have never seen.
+
+Videos that the API didn't return (deleted or private) are stored too, without details,
+so that they aren't requested again on every run.
+
+The VideoIDs of every playlist are stored as well (see module_reference_corpus.py), so a
+playlist is only paged through once.
+"""
+
+import json
+import time
+import sqlite3
+import threading
+
+
+class VideoDetailsCache:
+    """
+    Key-value store of video details keyed by VideoID, backed by SQLite.
+    """
+
+    # SQLite limits the number of parameters of a single query.
+    max_query_ids = 500
+
+    def __init__(self, db_path, ttl_sec=None):
+        """
+        param db_path -> Path of the SQLite database, created if it doesn't exist.
+        param ttl_sec -> Age (in seconds) after which cached details are fetched again.
+        None keeps them forever.
+        """
+        self.db_path = db_path
+        self.ttl_sec = ttl_sec
+        # The fetcher may write from several threads, a lock serializes the access.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS video_details ("
+                "VideoID TEXT PRIMARY KEY, Details TEXT, FetchedAt REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS playlist_items ("
+                "PlaylistID TEXT PRIMARY KEY, VideoIDs TEXT NOT NULL, FetchedAt REAL NOT NULL)"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get_many(self, video_ids):
+        """
+        param video_ids -> VideoIDs to look up.
+
+        returns a dictionary with key: VideoID and value: its details, or None if the API
+        didn't return the video. IDs that aren't cached (or have expired) are left out.
+        """
+        video_ids = list(dict.fromkeys(video_ids))
+        min_fetched_at = time.time() - self.ttl_sec if self.ttl_sec is not None else float("-inf")
+        cached = {}
+        with self.lock:
+            for limit in range(0, len(video_ids), self.max_query_ids):
+                some_ids = video_ids[limit : limit + self.max_query_ids]
+                rows = self.connection.execute(
+                    "SELECT VideoID, Details FROM video_details "
+                    f"WHERE FetchedAt >= ? AND VideoID IN ({','.join('?' * len(some_ids))})",
+                    [min_fetched_at, *some_ids],
+                )
+                for video_id, details in rows:
+                    cached[video_id] = json.loads(details) if details is not None else None
+        return cached
+
+    def put_many(self, all_details, missing_ids=()):
+        """
+        param all_details -> List of video details, each a dictionary with a VideoID key.
+        param missing_ids -> VideoIDs that were requested but not returned by the API.
+        """
+        fetched_at = time.time()
+        rows = [(details["VideoID"], json.dumps(details), fetched_at) for details in all_details]
+        rows += [(video_id, None, fetched_at) for video_id in missing_ids]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO video_details (VideoID, Details, FetchedAt) VALUES (?, ?, ?)",
+                rows,
+            )
+
+    def get_playlist(self, playlist_id):
+        """
+        returns the VideoIDs of the playlist in order, None if it isn't cached (or has expired).
+        """
+        min_fetched_at = time.time() - self.ttl_sec if self.ttl_sec is not None else float("-inf")
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT VideoIDs FROM playlist_items WHERE PlaylistID = ? AND FetchedAt >= ?",
+                (playlist_id, min_fetched_at),
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_playlist(self, playlist_id, video_ids):
+        """
+        param video_ids -> VideoIDs of every item of the playlist, in order.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO playlist_items (PlaylistID, VideoIDs, FetchedAt) VALUES (?, ?, ?)",
+                (playlist_id, json.dumps(list(video_ids)), time.time()),
+            )
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM video_details").fetchone()[0]
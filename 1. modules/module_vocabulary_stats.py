@@ -0,0 +1,147 @@
+r'''
+Frequency statistics of the reference corpus, from which the MusicVideoModel is derived.
+
+For every category, tag and description word we keep:
+    - tf: how many times it occurs in the corpus.
+    - df: in how many videos it occurs.
+along with the VideoIDs already counted. The statistics are stored in a JSON file, so:
+    - Adding a playlist only counts the videos that haven't been counted before.
+    - Two statistics of different videos can be merged.
+    - The top categories, tags and words can be taken again at any cutoff without
+    fetching anything.
+
+Every description is tokenized on its own, with the DescriptionTokenizer used to check the
+descriptions of the watched videos, so the words of two descriptions are never glued together.
+'''
+
+import os
+import json
+import string
+from collections import Counter
+import pandas as pd
+from module_description_tokenizer import DescriptionTokenizer
+from module_music_model import MusicVideoModel
+from module_storage import as_list
+
+
+class VocabularyStats:
+    '''
+    Mergeable tf/df counts of the categories, tags and description words of a set of videos.
+    '''
+
+    kinds = ('categories', 'tags', 'desc_words')
+
+    def __init__(self, stop_words=()):
+        '''
+        param stop_words -> Description words that aren't counted.
+        '''
+        self.stop_words = sorted(set(stop_words))
+        self.tokenizer = DescriptionTokenizer((), self.stop_words)
+        self.video_ids = set()
+        self.tf = {kind: Counter() for kind in self.kinds}
+        self.df = {kind: Counter() for kind in self.kinds}
+
+    def __len__(self):
+        return len(self.video_ids)
+
+    def video_terms(self, category_id, tags, description):
+        '''
+        returns the list of categories, tags and description words of a video, each term
+        as many times as it occurs.
+        '''
+        desc_words = [
+            word for word in self.tokenizer.tokenize(description) if word not in string.punctuation
+            ]
+        return {
+            'categories': [] if pd.isna(category_id) else [str(category_id)],
+            'tags': [tag.lower() for tag in as_list(tags)],
+            'desc_words': desc_words,
+            }
+
+    def add_videos(self, df):
+        '''
+        param df -> Dataframe with the VideoID, CategoryID, Tags and Description of videos.
+
+        Counts the videos that haven't been counted yet, returns their number.
+        '''
+        n_added = 0
+        for video_id, category_id, tags, description in zip(
+            df['VideoID'], df['CategoryID'], df['Tags'], df['Description']
+        ):
+            if video_id in self.video_ids:
+                continue
+            self.video_ids.add(video_id)
+            n_added += 1
+            for kind, terms in self.video_terms(category_id, tags, description).items():
+                self.tf[kind].update(terms)
+                self.df[kind].update(set(terms))
+        return n_added
+
+    def merge(self, other):
+        '''
+        Adds the counts of other, which must be of other videos, to these ones.
+        '''
+        if self.stop_words != other.stop_words:
+            raise ValueError("Statistics with different stopwords can't be merged.")
+        if not self.video_ids.isdisjoint(other.video_ids):
+            raise ValueError("Statistics counting the same videos can't be merged.")
+        self.video_ids |= other.video_ids
+        for kind in self.kinds:
+            self.tf[kind].update(other.tf[kind])
+            self.df[kind].update(other.df[kind])
+        return self
+
+    def top(self, kind, k, by='tf'):
+        '''
+        param kind -> 'categories', 'tags' or 'desc_words'.
+        param k -> Number of terms to keep, None for all of them.
+        param by -> 'tf' or 'df', the count the terms are ranked by.
+
+        returns the k most common terms with their counts, ties in alphabetical order.
+        '''
+        counts = self.tf[kind] if by == 'tf' else self.df[kind]
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+    def to_model(self, n_categories=2, n_tags=750, n_desc_words=250, by='tf'):
+        '''
+        returns a MusicVideoModel of the top categories, tags and description words.
+        '''
+        top_categories = self.top('categories', n_categories, by)
+        top_tags = self.top('tags', n_tags, by)
+        top_desc_words = self.top('desc_words', n_desc_words, by)
+        return MusicVideoModel(
+            category_ids=[int(category_id) for category_id, _ in top_categories],
+            category_counts=[count for _, count in top_categories],
+            tags=[tag for tag, _ in top_tags],
+            tag_counts=[count for _, count in top_tags],
+            desc_words=[word for word, _ in top_desc_words],
+            desc_counts=[count for _, count in top_desc_words],
+            )
+
+    def save(self, path):
+        state = {
+            'stop_words': self.stop_words,
+            'video_ids': sorted(self.video_ids),
+            'tf': {kind: dict(counts) for kind, counts in self.tf.items()},
+            'df': {kind: dict(counts) for kind, counts in self.df.items()},
+            }
+        # Writing to a temporary file first, so a crash never leaves truncated statistics.
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(state, file, ensure_ascii=False, sort_keys=True)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, stop_words=()):
+        '''
+        returns the statistics saved at path, or empty ones with stop_words if there are none yet.
+        '''
+        if not os.path.isfile(path):
+            return cls(stop_words)
+        with open(path, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+        stats = cls(state['stop_words'])
+        stats.video_ids = set(state['video_ids'])
+        stats.tf = {kind: Counter(state['tf'][kind]) for kind in cls.kinds}
+        stats.df = {kind: Counter(state['df'][kind]) for kind in cls.kinds}
+        return stats
@@ -1,19 +1,36 @@
 r'''
 
 Steps:
-    - First we extract the URL, Text(title), Date(only for json) and VideoID from the history file and create a csv.
+    - First we extract the URL, Text(title), play count, first/last watch Date and VideoID of every
+    video from the history file and create a table. Every single play is kept in a table of watch events.
     - If this file already exists, we open it.
     - For all the VideoIDs present, we fetch the details and add it to a dataframe.
     - If this file already exists, we open it.
-    - Figure out the period of our Watched History.
+    - Count the new plays into the listening analytics rollups, and figure out the period of
+    our Watched History from them.
     - Pass the dataframe that we created earlier through the first layer of music identification filter.
-    - Create a csv of the database.
+    - Create a table of the database.
+
+Tables are stored as parquet files by default, the format of every stage can be changed to csv
+in module_storage.stage_formats.
+
+Run with --jobs N to classify a large history on N processes (all the cores by default).
+
+Run with --incremental after downloading a new Takeout export: only the videos watched after
+the latest WatchDate of the previous run are parsed, fetched, classified and merged into the
+existing files.
+
+If the API quota runs out before all the details are fetched, the fetched ones are
+checkpointed and the script exits with code 3. Run it again after the quota resets to resume.
+
+The steps are functions, which pipeline.py (at the root of the repository) runs as the ingest,
+fetch and classify stages, only when their inputs have changed.
 '''
 
 import os
 import pandas as pd
-import json
 import sys
+import argparse
 from googleapiclient.discovery import build
 
 base_path = os.path.dirname(__file__)
@@ -21,8 +38,13 @@ modules_path = os.path.join(base_path, '../1. modules/')
 sys.path.insert(1, modules_path)
 
 from module_extract_urls_1 import ParseYtHistory
-from module_fetch_video_details_2 import FetchVideoDetails
+from module_fetch_video_details_2 import FetchVideoDetails, QuotaExhausted
 from module_identify_music_video_3 import IdentifyMusicVideo
+from module_video_details_cache import VideoDetailsCache
+from module_pipeline_state import PipelineState
+from module_fetch_scheduler import FetchScheduler
+from module_storage import stage_path, table_exists, read_table, write_table, append_table, memory_report
+from module_listening_analytics import ListeningAnalytics
 
 ####################################
 
@@ -31,13 +53,10 @@ from module_identify_music_video_3 import IdentifyMusicVideo
 history_file_path = os.path.join(base_path, '../_private_data/watch-history.json')
 api_key_path = os.path.join(base_path, '../_private_data/api_key.txt')
 
-def open_files(history_file_path, api_key_path, is_json=True):        
-    if is_json:
-        with open(history_file_path, 'r', encoding='utf-8') as file:
-            h = json.load(file)
-    else:
-        with open(history_file_path, 'r', encoding='utf-8') as file:
-            h = file.read()
+def open_files(history_file_path, api_key_path, is_json=True):
+    # Both the JSON and the HTML files are streamed by ParseYtHistory,
+    # so we only pass the path of the history file along.
+    h = history_file_path
 
     with open(api_key_path, 'r') as file:
         ak = file.read()
@@ -46,63 +65,273 @@ def open_files(history_file_path, api_key_path, is_json=True):
 
 #######################################
 
-# 2. Creating/Opening csv file that contains all details of our YT history.
-
-complete_history_details_path = os.path.join(base_path, '../_private_data/WatchedURLs_allDetails.csv')
-# We check if file with all details already exists. If not, we create it
-if os.path.isfile(complete_history_details_path):
-    print("File with all details exists... Opening...")
-    df_history_details = pd.read_csv(complete_history_details_path)
-else:
-    print("Fetching all details of your watched videos...")
-    print("Need csv with watched history URLs...")
-    history, api_key = open_files(history_file_path, api_key_path, is_json=True)
-    # To create the file with all details, we first need the csv with history URLs
-    # We open if it already exists, create it otherwise
-    watched_urls_path = os.path.join(base_path, '../_private_data/WatchedURLs.csv')
-    if os.path.isfile(watched_urls_path):
-        print("File containing history URLs exists... Opening...")
-        df_history_urls = pd.read_csv(watched_urls_path)
-    else:
-        print("Creating watched history URLs file from the history file...")
-        # We create the file using the ParseYtHistory class
-        df_history_urls = ParseYtHistory(history).createLinksCSV()
-        df_history_urls.to_csv(watched_urls_path, index=False, encoding='utf-8')
-        print("Watched history URL file created...")
-        
-    print("Fetching details using the API...")
+# 2. Creating/Opening the table that contains all details of our YT history.
+
+private_data_path = os.path.join(base_path, '../_private_data')
+watched_urls_path = stage_path(private_data_path, 'WatchedURLs')
+watch_events_path = stage_path(private_data_path, 'WatchEvents')
+complete_history_details_path = stage_path(private_data_path, 'WatchedURLs_allDetails')
+music_database_path = stage_path(os.path.join(base_path, 'songs_heard'), 'InitialMusicDatabase')
+analytics_path = os.path.join(private_data_path, 'ListeningAnalytics.sqlite')
+state_path = os.path.join(private_data_path, 'PipelineState.json')
+# Exit code of the scripts when the API quota runs out before all the details are fetched.
+quota_exit_code = 3
+
+def fetch_details(df_history_urls, api_key, daily_quota=10000):
     yt = build('youtube', 'v3', developerKey=api_key)
-    df_history_details = FetchVideoDetails(yt, df_history_urls).get_complete_details()
-    df_history_details.to_csv(complete_history_details_path, index=False, encoding='utf-8')
+    # Details of every video fetched so far are cached, only new VideoIDs cost API quota.
+    details_cache_path = os.path.join(base_path, '../_private_data/VideoDetailsCache.sqlite')
+    # The scheduler stops the fetch at the daily quota and checkpoints every batch,
+    # so a large history is fetched over several runs.
+    scheduler = FetchScheduler(os.path.join(base_path, '../_private_data/FetchCheckpoint'), daily_quota)
+    with VideoDetailsCache(details_cache_path) as details_cache:
+        fetcher = FetchVideoDetails(
+            yt, df_history_urls, max_workers=8, requests_per_sec=20,
+            cache=details_cache, scheduler=scheduler
+            )
+        df_details = fetcher.get_complete_details()
+    if not fetcher.complete:
+        print(f"Daily API quota reached after fetching {len(df_details)} of {df_history_urls['VideoID'].nunique()} videos...")
+        print("Run the script again after the quota resets (midnight Pacific Time) to resume.")
+        # The entry points turn it into an exit code, the fetched batches stay checkpointed.
+        raise QuotaExhausted("The daily API quota is used up before all the details were fetched.")
+    scheduler.clear()
+    return df_details
+
+def merge_into_table(table_path, df_new, df_plays):
+    '''
+    Adds the rows of df_new to the table, replacing the old rows of the same VideoID.
+    The play counts of every row are then refreshed from df_plays.
+    Returns the merged dataframe.
+    '''
+    df_old = read_table(table_path)
+    # An empty df_new only refreshes the play counts, its columns aren't added to the table.
+    df_merged = pd.concat([df_old, df_new] if len(df_new) else [df_old], ignore_index=True)
+    df_merged.drop_duplicates(subset=['VideoID'], keep='last', inplace=True)
+    play_columns = ['PlayCount', 'FirstSeen', 'LastSeen']
+    df_merged = pd.merge(
+        df_merged.drop(columns=play_columns, errors='ignore'),
+        df_plays[['VideoID'] + play_columns], on='VideoID', how='left'
+        )
+    # Categoricals of the old and new rows don't share their categories, they are rebuilt.
+    df_merged = FetchVideoDetails.compact_details(df_merged)
+    write_table(df_merged, table_path)
+    return df_merged
+
+def ingest():
+    '''
+    Parses the whole history file into the watch events and the watched URLs tables.
+    Returns both dataframes.
+    '''
+    print("Creating watched history URLs file from the history file...")
+    # We create the file using the ParseYtHistory class, which streams the history file. Along with one row per video
+    # and its play count, we keep every single play in the watch events file.
+    df_events, df_history_urls = ParseYtHistory(history_file_path).createHistoryTables()
+    write_table(df_events, watch_events_path)
+    write_table(df_history_urls, watched_urls_path)
+    print("Watched history URL file created...")
+    return df_events, df_history_urls
+
+def fetch(df_history_urls=None):
+    '''
+    Fetches the details of every watched video (from the watched URLs table by default) into
+    the table with all details. Returns the dataframe of the details.
+    '''
+    if df_history_urls is None:
+        df_history_urls = read_table(watched_urls_path)
+    _, api_key = open_files(history_file_path, api_key_path, is_json=True)
+    print("Fetching details using the API...")
+    df_history_details = fetch_details(df_history_urls, api_key)
+    write_table(df_history_details, complete_history_details_path)
     print("File with all details created...")
-    
-# Figuring out the duration of our history.
-if 'WatchDate' in df_history_details.columns:
-    df_history_details['WatchDate'] = pd.to_datetime(df_history_details['WatchDate'])
-    min_date = df_history_details['WatchDate'].min().date()
-    max_date = df_history_details['WatchDate'].max().date()
-    print(f"The history file contains data from dates(yy-mm-dd) {min_date.strftime('%y-%m-%d')} to {max_date.strftime('%y-%m-%d')}.")
-    print(f"Number of days: {(max_date-min_date).days}.")
-    print(f"Number of months (approx): {(max_date-min_date).days//30}.\n")
-
-#########################################
-
-print("Building an initial database...")
-music_database_path = os.path.join(base_path, 'songs_heard/InitialMusicDatabase.csv')
-watched_music_videos = IdentifyMusicVideo(df_history_details).filter_music_video()
-watched_music_videos.to_csv(music_database_path, index=False, encoding='utf-8')
-print("Done!")
+    return df_history_details
+
+def classify(df_history_details=None, n_jobs=os.cpu_count()):
+    '''
+    param n_jobs -> Number of processes a large history is classified on (see module_identify_music_video_3.py).
+
+    Passes the details of every video (from the table with all details by default) through
+    the first layer of music identification, and writes the initial database.
+    Returns the dataframe of the initial database.
+    '''
+    if df_history_details is None:
+        df_history_details = FetchVideoDetails.compact_details(read_table(complete_history_details_path))
+    print("Building an initial database...")
+    watched_music_videos = IdentifyMusicVideo(df_history_details, n_jobs=n_jobs).filter_music_video()
+    write_table(watched_music_videos, music_database_path)
+    return watched_music_videos
+
+def count_plays(df_history_details=None, df_events=None):
+    '''
+    Counts the plays not counted yet (from the watch events table by default) into the
+    listening analytics rollups, and prints the period of our history and its most played videos.
+    '''
+    if df_history_details is None:
+        df_history_details = FetchVideoDetails.compact_details(read_table(complete_history_details_path))
+    if df_events is None and table_exists(watch_events_path):
+        df_events = read_table(watch_events_path)
+
+    # Remembering the latest WatchDate processed, for the next incremental run. It's taken
+    # from the plays, which are kept even for the videos without details.
+    if df_events is not None:
+        PipelineState(state_path).update_last_watch_date(pd.to_datetime(df_events['WatchDate'], utc=True))
+    elif 'LastSeen' in df_history_details.columns:
+        PipelineState(state_path).update_last_watch_date(pd.to_datetime(df_history_details['LastSeen'], utc=True))
+
+    # Every play not counted yet is added to the listening rollups (see module_listening_analytics.py).
+    with ListeningAnalytics(analytics_path) as analytics:
+        if df_events is not None:
+            n_counted = analytics.add_events(df_events, df_history_details)
+            print(f"{n_counted} plays added to the listening analytics...")
+        # Figuring out the duration of our history, from the daily rollups.
+        min_date, max_date = analytics.date_range()
+
+    if min_date is not None:
+        print(f"The history file contains data from dates(yy-mm-dd) {min_date.strftime('%y-%m-%d')} to {max_date.strftime('%y-%m-%d')}.")
+        print(f"Number of days: {(max_date-min_date).days}.")
+        print(f"Number of months (approx): {(max_date-min_date).days//30}.\n")
+
+    if 'PlayCount' in df_history_details.columns:
+        # The songs we keep coming back to.
+        most_played = df_history_details.nlargest(5, 'PlayCount')
+        print("Most played videos:")
+        for title, play_count in zip(most_played['Title'], most_played['PlayCount']):
+            print(f"  {play_count:>4} plays - {title}")
+
+def can_update_incrementally(*table_paths):
+    '''
+    returns True if the plays of an earlier run have been counted (see count_plays) and the
+    tables at table_paths exist, so that only the newer history needs to be handled.
+    '''
+    return PipelineState(state_path).last_watch_date is not None and all(map(table_exists, table_paths))
+
+def ingest_new(last_watch_date):
+    '''
+    Parses the plays of the history file after last_watch_date, and adds them to the watch
+    events and the watched URLs tables. Returns the new plays and the watched URLs.
+    '''
+    # Plays added by a run that stopped before counting them (e.g. when the API quota ran
+    # out) are already in the watch events table, they aren't added again.
+    latest_event = read_table(watch_events_path, columns=['WatchDate'])['WatchDate'].max()
+    if pd.notna(latest_event) and latest_event > last_watch_date:
+        last_watch_date = latest_event
+    parser = ParseYtHistory(history_file_path, since=last_watch_date)
+    df_new_events, df_new_urls = parser.createHistoryTables()
+    print(f"{len(df_new_events)} new plays of {len(df_new_urls)} videos found in the history file...")
+    if parser.n_undated:
+        print(f"{parser.n_undated} entries without a readable watch date were skipped...")
+    df_history_urls = read_table(watched_urls_path)
+    if len(df_new_events):
+        # The plays are kept even if no details can be fetched for their videos (deleted
+        # or private videos), so that they are counted and never parsed again.
+        append_table(df_new_events, watch_events_path)
+        # Play counts of the videos seen before are added to the new ones.
+        df_history_urls = ParseYtHistory.combinePlays(df_history_urls, df_new_urls)
+        write_table(df_history_urls, watched_urls_path)
+    return df_new_events, df_history_urls
+
+def fetch_new(df_history_urls=None):
+    '''
+    Fetches the details of the watched videos (from the watched URLs table by default) that
+    aren't in the table with all details yet, and merges them into it. Returns the details of
+    every video and the details of the new ones.
+    '''
+    if df_history_urls is None:
+        df_history_urls = read_table(watched_urls_path)
+    known_ids = read_table(complete_history_details_path, columns=['VideoID'])['VideoID']
+    # Videos without details (deleted or private) are never in the table, their absence is
+    # cached and costs no API quota.
+    df_new_urls = df_history_urls.loc[~df_history_urls['VideoID'].isin(known_ids)]
+    if len(df_new_urls):
+        _, api_key = open_files(history_file_path, api_key_path, is_json=True)
+        print(f"Fetching details of {len(df_new_urls)} videos not fetched before using the API...")
+        df_new_details = fetch_details(df_new_urls, api_key)
+    else:
+        df_new_details = df_new_urls
+    df_history_details = merge_into_table(complete_history_details_path, df_new_details, df_history_urls)
+    return df_history_details, df_new_details
+
+def update_incrementally(last_watch_date, n_jobs=os.cpu_count()):
+    '''
+    Parses, fetches and classifies the videos watched after last_watch_date, and merges them
+    into the existing tables. Returns the details, the initial database and the new plays.
+    '''
+    print(f"Incremental run: processing videos watched after {last_watch_date}...")
+    df_new_events, df_history_urls = ingest_new(last_watch_date)
+    df_history_details, df_new_details = fetch_new(df_history_urls)
+    print("Adding the new videos to the initial database...")
+    new_music_videos = IdentifyMusicVideo(df_new_details, n_jobs=n_jobs).filter_music_video() if len(df_new_details) else df_new_details
+    watched_music_videos = merge_into_table(music_database_path, new_music_videos, df_history_urls)
+    return df_history_details, watched_music_videos, df_new_events
+
+def main(incremental=False, n_jobs=os.cpu_count()):
+    '''
+    param incremental -> Whether only the history newer than the last processed WatchDate is handled.
+    param n_jobs -> Number of processes a large history is classified on.
+    '''
+    can_run_incrementally = can_update_incrementally(
+        watched_urls_path, watch_events_path, complete_history_details_path, music_database_path
+        )
+
+    if incremental and can_run_incrementally:
+        df_history_details, watched_music_videos, _ = update_incrementally(PipelineState(state_path).last_watch_date, n_jobs)
+        # The plays are read from the watch events table, along with the ones added by an
+        # earlier run that stopped before counting them.
+        df_events = None
+    else:
+        if incremental:
+            print("No earlier run to build upon, processing the whole history...")
+        # The plays are read from the watch events table, unless it's created below.
+        df_events = None
+        # We check if file with all details already exists. If not, we create it
+        if table_exists(complete_history_details_path):
+            print("File with all details exists... Opening...")
+            df_history_details = FetchVideoDetails.compact_details(read_table(complete_history_details_path))
+        else:
+            print("Fetching all details of your watched videos...")
+            print("Need table with watched history URLs...")
+            # To create the file with all details, we first need the table with history URLs
+            # We open if it already exists, create it otherwise
+            if table_exists(watched_urls_path):
+                print("File containing history URLs exists... Opening...")
+                df_history_urls = read_table(watched_urls_path)
+            else:
+                df_events, df_history_urls = ingest()
+            df_history_details = fetch(df_history_urls)
+        watched_music_videos = classify(df_history_details, n_jobs)
+
+    count_plays(df_history_details, df_events)
+
+    # How much memory the tables of the pipeline take, with the compact dtypes.
+    print(memory_report({
+        'WatchedURLs_allDetails': df_history_details,
+        'InitialMusicDatabase': watched_music_videos,
+        }))
+
+    print("Done!")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Builds the initial database of possible music videos from the history file.")
+    parser.add_argument('--incremental', action='store_true', help="only handles the history newer than the last processed WatchDate")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="number of processes a large history is classified on")
+    args = parser.parse_args()
+    try:
+        main(incremental=args.incremental, n_jobs=args.jobs)
+    except QuotaExhausted:
+        # Nothing after the fetch has run, the next run resumes it.
+        sys.exit(quota_exit_code)
 
 ##########################################
 
 # Fetching all details of your watched videos...
-# Need csv with watched history URLs...
+# Need table with watched history URLs...
 # File containing history URLs exists... Opening...
 # Fetching details using the API...
 # File with all details created...
+# Building an initial database...
 # The history file contains data from dates(yy-mm-dd) 21-08-03 to 22-01-09.
 # Number of days: 159.
 # Number of months (approx): 5.
 
-# Building an initial database...
 # Done!
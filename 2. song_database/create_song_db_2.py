@@ -9,74 +9,150 @@ types:
     - If the sheet to be checked is manually verified and pasted into the sheet called 
     ManuallyCHECKEDMusic.xlsx, we combine the confirmed music with this and save the final excel
     file as our MusicDatabse :)
+
+Run with --incremental after an incremental run of create_song_db_1: the videos already in
+ManuallyCHECKEDMusic.xlsx aren't sent for manual checking again, and the new music is merged
+into the existing FinalMusicDATABASE table.
+
+Run with --score to categorize the videos by their MusicScore instead of the three checks
+(see module_music_scorer.py). The thresholds below can be tuned to trade the number of videos
+to check manually against the number of videos wrongly categorized. They have only been checked
+against music videos: on the committed FinalMusicDATABASE, 457 of the 469 videos score at least
+music_threshold, the 12 others are left as Maybe and none score below not_music_threshold. How
+many videos that aren't music they would label Y is unknown.
+
+The labelled videos are kept in the TriagedMusicDatabase table, so that pipeline.py (at the root
+of the repository) runs the triage and the export as two stages, each only when its inputs
+have changed.
 '''
 
 import pandas as pd
 import os
+import sys
 
 base_path = os.path.dirname(__file__)
-# Opening the file containing the details of initial filtered videos by create_song_db_1
-df_init_db = pd.read_csv(os.path.join(base_path, 'songs_heard/InitialMusicDatabase.csv'))
+modules_path = os.path.join(base_path, '../1. modules/')
+sys.path.insert(1, modules_path)
+
+from module_identify_music_video_3 import IdentifyMusicVideo
+from module_triage_music_4 import triage_music
+from module_storage import stage_path, table_exists, read_table, write_table, as_excel_sheet
+from module_song_search import SongSearchIndex
+
+# Videos scoring at least music_threshold are music, below not_music_threshold they aren't.
+music_threshold = 2.5
+not_music_threshold = 0.5
+init_db_path = stage_path(os.path.join(base_path, 'songs_heard'), 'InitialMusicDatabase')
+triaged_db_path = stage_path(os.path.join(base_path, 'songs_heard'), 'TriagedMusicDatabase')
+manual_check_path = os.path.join(base_path, 'songs_heard/ManuallyCheckMusic.xlsx')
+manually_checked_path = os.path.join(base_path, 'songs_heard/ManuallyCHECKEDMusic.xlsx')
+final_music_db_path = stage_path(base_path, 'FinalMusicDATABASE')
+search_index_path = os.path.join(base_path, 'SongSearchIndex.sqlite')
 
-def is_music(cid, cc, tc, dc):
+#########################################
+
+def triage(df_init_db=None, scoring=False, incremental=False, thresholds=(music_threshold, not_music_threshold)):
     '''
-    Function to categorize a video into a music video.
-    
-    Returns Y, N or Maybe
-    
-    Working:
-        - YouTube identifies music video as 10. Therefore, classify a video as 
-        a music vidoe if CategoryID -> 10 or all three checks = 1
-        - Otherwise:
-            -> If all three checks = 0, video is definitely not music
-            -> In all other cases, the video may or may not be music.
+    param df_init_db -> The initial database created by create_song_db_1, read from its table by default.
+    param scoring -> Whether the videos are categorized by their MusicScore instead of the three checks.
+    param incremental -> Whether the videos already in ManuallyCHECKEDMusic.xlsx are left out of
+    the sheet of videos to check manually.
+    param thresholds -> The music_threshold and not_music_threshold of the MusicScore, when scoring.
+
+    Labels every video, writes them to the triaged database and the Maybe videos to the sheet
+    to check manually. Returns the labelled initial database and the videos that are music.
     '''
-    if int(cid)==10 or cc+tc+dc==3:
-        return 'Y'
-    else:
-        if cc+tc+dc==0:
-            return 'N'
-        
-        return 'Maybe'
+    if df_init_db is None:
+        df_init_db = read_table(init_db_path)
+    print(f"Categorizing {len(df_init_db)} videos into Music, Not Music or Maybe Music...")
 
-#########################################
+    scorer = None
+    if scoring:
+        identifier = IdentifyMusicVideo(
+            df_init_db,
+            scorer_options={'music_threshold': thresholds[0], 'not_music_threshold': thresholds[1]},
+            )
+        scorer = identifier.get_scorer()
+        # The videos are only scored when they are triaged by their score.
+        df_init_db['MusicScore'] = identifier.score_videos(df_init_db)
+
+    # We label every video as Y, Maybe or N (see module_triage_music_4), and get the
+    # videos that are definitely music and the ones to check manually.
+    df_init_db, music_videos_db, manual_check_db, _ = triage_music(df_init_db, scorer)
+    write_table(df_init_db, triaged_db_path)
+    print(f"{len(music_videos_db)} videos are categorized as music...")
 
-print(f"Categorizing {len(df_init_db)} videos into Music, Not Music or Maybe Music...")
-
-# We create a tuple of the following columns, and pass it to the is_music function to perform the checks.
-df_init_db['Is_Music'] = df_init_db[['CategoryID', 'CategoryCheck', 'TagsCheck', 'DescriptionCheck']].apply(
-    lambda x: is_music(*x), axis=1
-    )
-
-# We filter the videos that are definitely music
-music_videos_db = df_init_db.loc[df_init_db['Is_Music']=='Y']
-print(f"{len(music_videos_db)} videos are categorized as music...")
-
-# We seperate the Maybe videos into an excel file.
-manual_check_db = df_init_db.loc[df_init_db['Is_Music']=='Maybe']
-manual_check_db.reset_index(inplace=True, drop=True)
-print(f"{len(manual_check_db)} videos must be manually checked if you want a thorough list :(")
-
-print("Creating an excel file of videos to be manually checked...")
-# We add a column with a default value of No, which can be manually toggled by the user to Y.
-manual_check_db['Is_Music_Manual'] = pd.Series(['N']*len(manual_check_db), dtype='str')
-manual_check_db.to_excel(
-    os.path.join(base_path, 'songs_heard/ManuallyCheckMusic.xlsx'), index=False, encoding='utf-8'
-    )
-print("Done...")
-
-# We check if the user has already create a file after manual checking, if so we 
-# open it and add it to the file that contains videos that are definitely music.
-print("Checking if a new file after manual check has been created...")
-if os.path.isfile(os.path.join(base_path, 'songs_heard/ManuallyCHECKEDMusic.xlsx')):
+    # We seperate the Maybe videos into an excel file.
+    if incremental and os.path.isfile(manually_checked_path):
+        # Videos that have already been checked by hand don't need to be checked again.
+        already_checked_ids = pd.read_excel(manually_checked_path, usecols=['VideoID'], dtype={'VideoID': str})['VideoID']
+        manual_check_db = manual_check_db.loc[~manual_check_db['VideoID'].isin(already_checked_ids)]
+    manual_check_db.reset_index(inplace=True, drop=True)
+    print(f"{len(manual_check_db)} videos must be manually checked if you want a thorough list :(")
+
+    print("Creating an excel file of videos to be manually checked...")
+    # We add a column with a default value of No, which can be manually toggled by the user to Y.
+    manual_check_db['Is_Music_Manual'] = pd.Series(['N']*len(manual_check_db), dtype='str')
+    # Excel cells can't hold lists, the Tags and Description are written as text.
+    as_excel_sheet(manual_check_db).to_excel(manual_check_path, index=False, encoding='utf-8')
+    print("Done...")
+    return df_init_db, music_videos_db
+
+def export(df_init_db=None, music_videos_db=None, incremental=False):
+    '''
+    param df_init_db -> The labelled initial database, read from the triaged database by default.
+    param music_videos_db -> The videos that are music, its Y videos by default.
+    param incremental -> Whether the songs of the earlier runs stay in the final database.
+
+    Adds the videos checked manually to the videos that are music, and writes the final
+    database. Returns it, None if no video has been checked manually yet.
+    '''
+    if df_init_db is None:
+        df_init_db = read_table(triaged_db_path)
+    if music_videos_db is None:
+        music_videos_db = df_init_db.loc[df_init_db['Is_Music'] == 'Y']
+
+    # We check if the user has already create a file after manual checking, if so we 
+    # open it and add it to the file that contains videos that are definitely music.
+    print("Checking if a new file after manual check has been created...")
+    if not os.path.isfile(manually_checked_path):
+        print("You need to create a file with manual checks...")
+        return None
     print("Opening the Checked file to create a final database...")
-    manually_checked_db = pd.read_excel(os.path.join(base_path, 'songs_heard/ManuallyCHECKEDMusic.xlsx'))
+    manually_checked_db = pd.read_excel(manually_checked_path)
     music_video_db_manual = manually_checked_db.loc[manually_checked_db['Is_Music_Manual']=='Y']
     final_music_db = pd.concat([music_video_db_manual, music_videos_db], ignore_index=True)
-    final_music_db.to_csv('FinalMusicDATABASE.csv', index=False, encoding='utf-8')
+    if incremental and table_exists(final_music_db_path):
+        # Songs of the earlier runs stay in the database, the new ones are added to it.
+        df_final_old = read_table(final_music_db_path)
+        final_music_db = pd.concat([df_final_old, final_music_db], ignore_index=True)
+    final_music_db.drop_duplicates(subset=['VideoID'], keep='last', inplace=True)
+    if 'PlayCount' in df_init_db.columns:
+        # The play counts of the initial database are the latest ones.
+        play_columns = ['PlayCount', 'FirstSeen', 'LastSeen']
+        final_music_db = pd.merge(
+            final_music_db.drop(columns=play_columns, errors='ignore'),
+            df_init_db[['VideoID'] + play_columns], on='VideoID', how='left'
+            )
+    write_table(final_music_db, final_music_db_path)
     print("Database created... :D")
-else:
-    print("You need to create a file with manual checks...")
+
+    # The new and changed songs are added to the search index (see search_songs.py), and
+    # the songs no longer in the database are removed from it.
+    with SongSearchIndex(search_index_path) as index:
+        n_indexed = index.add_songs(final_music_db)
+        index.remove_songs(index.video_ids() - set(final_music_db['VideoID']))
+    print(f"{n_indexed} songs added to the search index...")
+    return final_music_db
+
+def main(incremental=False, scoring=False):
+    # Opening the table containing the details of initial filtered videos by create_song_db_1
+    df_init_db, music_videos_db = triage(read_table(init_db_path), scoring, incremental)
+    export(df_init_db, music_videos_db, incremental)
+
+
+if __name__ == '__main__':
+    main(incremental='--incremental' in sys.argv[1:], scoring='--score' in sys.argv[1:])
 
 ###############################################################################
 
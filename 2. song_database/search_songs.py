@@ -0,0 +1,37 @@
+r'''
+Finds songs of the music database, e.g. that song you heard but can't remember the name of.
+
+The songs are looked up in the search index kept up to date by create_song_db_2.py, so the
+database itself is never read:
+    python search_songs.py john mayer gravity
+Run with --prefix to also match the words starting with the last one:
+    python search_songs.py --prefix gravi
+'''
+
+import os
+import sys
+
+base_path = os.path.dirname(__file__)
+modules_path = os.path.join(base_path, '../1. modules/')
+sys.path.insert(1, modules_path)
+
+from module_song_search import SongSearchIndex
+
+prefix = '--prefix' in sys.argv[1:]
+query = ' '.join(arg for arg in sys.argv[1:] if arg != '--prefix')
+search_index_path = os.path.join(base_path, 'SongSearchIndex.sqlite')
+
+if not os.path.isfile(search_index_path):
+    print("The search index doesn't exist yet, run create_song_db_2.py first...")
+    sys.exit(1)
+
+with SongSearchIndex(search_index_path) as index:
+    results = index.search(query, k=10, prefix=prefix)
+
+if not results:
+    print(f"No song matches '{query}'...")
+for result in results:
+    channel = f" ({result.ChannelTitle})" if result.ChannelTitle else ''
+    print(f"{result.Score:6.2f}  {result.Title}{channel} https://www.youtube.com/watch?v={result.VideoID}")
+
+###############################################################################
@@ -1,30 +1,123 @@
 r'''
 This module does the following:
-    - Creates a text file of all the words used in the title, tags and description.
-    - Creates 10 wordcloud images from the text file and combines them to form a GIF.
+    - Counts all the words used in the title, tags and description, and saves the counts
+    into the WordFrequencies table, which later runs read instead of counting again.
+    - Creates wordclouds from the counts and combines them to form a GIF. The clouds are
+    laid out in parallel on a pool of processes, and their pixels are written straight
+    into the GIF in order, without going through matplotlib or image files.
+
+Run with --recount to count the words of a new database again, pipeline.py (at the root of the
+repository) does so whenever the database has changed.
 '''
 
 import os
-import glob
+import sys
 import string
-import random
 import imageio
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from collections import Counter
+from itertools import chain
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from wordcloud import WordCloud, STOPWORDS
 
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../1. modules/'))
+from module_storage import stage_path, existing_path, table_exists, read_table, write_table
+
+
+def render_frame(frame):
+    '''
+    param frame -> (options, words) of a wordcloud: the options of the WordCloud, and
+    either a text or a dictionary of word frequencies.
+
+    returns the wordcloud as an RGB array.
+    '''
+    options, words = frame
+    wc = WordCloud(**options)
+    if isinstance(words, str):
+        wc.generate(words)
+    else:
+        wc.generate_from_frequencies(words)
+    return wc.to_array()
+
+
+def render_frames(frames, n_jobs=1, window=None):
+    '''
+    param frames -> Iterable of the (options, words) of every frame.
+    param n_jobs -> Number of processes laying out the frames.
+    param window -> Maximum number of frames submitted ahead of the one being yielded,
+    2*n_jobs by default.
+
+    Yields the RGB array of every frame, in order.
+    '''
+    if n_jobs <= 1:
+        yield from map(render_frame, frames)
+        return
+    window = window or 2 * n_jobs
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        pending = deque()
+        for frame in frames:
+            pending.append(executor.submit(render_frame, frame))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
 class CreateWordCloud:
     '''
     Class to create the wordcloud animation.
     '''
+
+    # WordCloud options of the cloud of all the words, and of the clouds building up to it.
+    complete_options = dict(
+        width=1100,
+        height=1300,
+        margin=0,
+        mask=None,
+        max_words=190,
+        min_font_size=5,
+        stopwords=STOPWORDS,
+        random_state=23,
+        background_color='white',
+        max_font_size=None,
+        font_step=1,
+        mode='RGB',
+        colormap='ocean',
+        contour_width=0,
+        contour_color='black',
+        min_word_length=4
+    )
+    build_up_options = dict(
+        width=1100,
+        height=1300,
+        margin=0,
+        mask=None,
+        scale=1,
+        max_words=200,
+        min_font_size=5,
+        stopwords=STOPWORDS,
+        random_state=15,
+        background_color='white',
+        max_font_size=None,
+        font_step=1,
+        mode='RGB',
+        collocations=True,
+        colormap='ocean',
+        contour_width=0,
+        contour_color='black',
+        min_word_length=3
+    )
     
-    def __init__(self, df_music, ignore_words=None):
+    def __init__(self, df_music, frequencies_path, ignore_words=None):
         '''
         param df_music -> DataFrame of the final music database
+        param frequencies_path -> Path of the table of word counts of the database.
         param ignore_words -> Words that we choose to ignore from our wordclouds.
         '''
         self.df_music = df_music
+        self.frequencies_path = frequencies_path
+        self.word_counts = None
         self.ignore_words = ignore_words
         if self.ignore_words is None:
             self.ignore_words = [
@@ -55,199 +148,151 @@ class CreateWordCloud:
                 ]
     
 
-    @staticmethod
-    def remove_punct(wstr):
-        '''
-        param wstr -> string containing all the texts that we extracted from the
-        music databse.
-        
-        Function removes punctuation and some special characters and replaces them
-        with a blank space.
-        
-        returns updated string with no punctuations and some special characters.
-        '''
-        nwstr = ''
-        for char in wstr:
-            if (char not in string.punctuation) and (char not in ('|', '(', ')', '-', ':', '[', ']')):
-                nwstr += char
+    # Punctuation is replaced by a blank space. Apostrophes and hashes are dropped, so that
+    # words like don't and #pop stay whole.
+    punctuation_table = str.maketrans({**dict.fromkeys(string.punctuation, ' '), "'": None, '#': None})
+
+    def all_texts(self):
+        '''
+        Yields every Title, Tag and Description word of the music database.
+        '''
+        yield from self.df_music['Title'].dropna()
+        for column in ('Tags', 'Description'):
+            for words in self.df_music[column]:
+                yield from words
+
+    def count_words(self):
+        '''
+        returns a Counter of the lower-cased words of the Titles, Tags and Descriptions,
+        without punctuation and the words we ignore.
+        '''
+        ignore_words = set(self.ignore_words)
+        table = CreateWordCloud.punctuation_table
+        words = chain.from_iterable(text.translate(table).lower().split() for text in self.all_texts())
+        return Counter(word for word in words if word not in ignore_words)
+
+    def get_word_counts(self):
+        '''
+        returns a dictionary with key: word and value: the number of times it's used in the
+        music database, most common first.
+
+        The counts are saved to the WordFrequencies table the first time, later runs read them
+        from there. Delete the table to count the words of a new database.
+        '''
+        if self.word_counts is None:
+            if table_exists(self.frequencies_path):
+                df_counts = read_table(self.frequencies_path)
+                self.word_counts = dict(zip(df_counts['Word'], df_counts['Count'].tolist()))
             else:
-                nwstr += ' '
-        return nwstr
-    
-    
-    def get_words_string(self, create_text_file=True):
-        '''
-        param create_text_file -> Set to True(default), if we want to save the words
-        we will be using in a text file.
-        
-        Combines the Title, Tags and description to create a text file of all 
-        the words present in our database.
-        '''
-        
-        # Check if the file already exists. If not, extract words 
-        if os.path.isfile('AllWordsMusicDatabase.txt'):
-            with open('AllWordsMusicDatabase.txt', 'r', encoding='utf-8') as file:
-                words_string_clean = file.read()
-        else:
-            
-            # Creating a continuous string of all the Titles.
-            all_titles = list(self.df_music['Title'])
-            all_titles_str = ' '.join(all_titles)
-            
-            # Since tags are a list of strings, we perform the following sequence
-            # to create a continuous string of all the Tags used.
-            all_tags = list(self.df_music['Tags'].str.strip('[]').str.split(','))
-            all_tags = [tag for tag_list in all_tags for tag in tag_list]
-            all_tags_str = ' '.join(all_tags)
-            all_tags_str = all_tags_str.replace("'", '')
-            
-            # We perform a similar operation as above for the description.
-            all_desc = list(self.df_music['Description'].str.strip('[]').str.split(','))
-            all_desc = [desc for desc_list in all_desc for desc in desc_list]
-            all_desc_str = ' '.join(all_desc)
-            all_desc_str = all_desc_str.replace("'", '')
-            all_desc_str = all_desc_str.replace("#", '')
-            
-            # Join the titles, tags and description to form one single string and
-            # remove unnecessary punctuation.
-            words_string = all_titles_str + ' ' + all_tags_str + ' ' + all_desc_str
-            words_string_clean = CreateWordCloud.remove_punct(words_string)
-            words_string_clean = ' '.join([
-                words.lower() for words in words_string_clean.split() if words.lower() not in self.ignore_words
-                ])
-            
-            if create_text_file:
-                with open('AllWordsMusicDatabase.txt', 'w', encoding='utf-8') as file:
-                    file.write(words_string_clean)
-        
-        return words_string_clean
-        
-    def generateWC(self, part=999):
-        '''
-        param part -> Used to specify the name of the Final WordCloud image.
-        
-        Function generates a random cloud using all the words stored from
-        title, tag and description.
-        '''
-        words_clean = self.get_words_string()
-        fig = plt.figure(figsize=(9,9))
-        fig.patch.set_facecolor('white')
-        wc = WordCloud(
-            width=1100,
-            height=1300,
-            margin=0,
-            mask=None,
-            max_words=190,
-            min_font_size=5,
-            stopwords=STOPWORDS,
-            random_state=23,
-            background_color='white',
-            max_font_size=None,
-            font_step=1,
-            mode='RGB',
-            collocations=True,
-            colormap='ocean',
-            contour_width=0,
-            contour_color='black',
-            min_word_length=4
-        )
-        wc.generate(words_clean)
-        plt.imshow(wc, interpolation='bilinear')
-        plt.axis('off')
-        plt.savefig(f'photos/WordCloud_{part}.png')
-        
-        
-    def randomWcs(self):
+                self.word_counts = dict(self.count_words().most_common())
+                df_counts = pd.DataFrame({'Word': list(self.word_counts), 'Count': list(self.word_counts.values())})
+                write_table(df_counts.astype({'Count': 'int32'}), self.frequencies_path)
+        return self.word_counts
+
+    @staticmethod
+    def cloud_frequencies(word_counts, min_word_length):
+        '''
+        returns the counts of the words that can be part of a wordcloud: WordCloud only filters
+        the stopwords, short words and numbers out of text, not out of frequencies.
+        '''
+        return {
+            word: count for word, count in word_counts.items()
+            if len(word) >= min_word_length and word not in STOPWORDS and not word.isdigit()
+            }
+
+    def complete_frame(self):
+        '''
+        returns the frame of the cloud of all the words stored from title, tag and description.
+        '''
+        frequencies = CreateWordCloud.cloud_frequencies(
+            self.get_word_counts(), self.complete_options['min_word_length']
+            )
+        return self.complete_options, frequencies
+
+    def build_up_frequencies(self, n_words=350, wc_count=5, n_parts=10):
+        '''
+        param n_words -> Number of most common words the clouds are made of.
+        param wc_count -> The clouds building up to the complete one are parts 1 to wc_count-1.
+        param n_parts -> Number of parts the words are divided into.
+
+        Yields the word frequencies of every cloud building up to the complete one.
+
+        Laying out the top words in increasing order of their frequency, each repeated
+        as many times as it's used, the cloud of a part holds the words of the first
+        part/n_parts of that text. The text itself is never built: the number of
+        repetitions of every word within the part is computed from the counts.
+        '''
+        top_words = Counter(self.get_word_counts()).most_common(n_words)[::-1]
+        words = [word for word, _ in top_words]
+        counts = np.array([count for _, count in top_words], dtype='int64')
+        # Length of a repetition of every word, with the blank space after it.
+        lengths = np.array([len(word) + 1 for word in words], dtype='int64')
+        starts = np.concatenate([[0], np.cumsum(lengths * counts)[:-1]])
+        text_length = int((lengths * counts).sum())
+
+        min_word_length = self.build_up_options['min_word_length']
+        for part in range(1, wc_count):
+            part_length = part * text_length // n_parts + 1
+            # A repetition is in the part if the word fits, its blank space doesn't need to.
+            repetitions = np.clip((part_length - starts + 1) // lengths, 0, counts)
+            frequencies = {word: int(count) for word, count in zip(words, repetitions) if count}
+            yield CreateWordCloud.cloud_frequencies(frequencies, min_word_length)
+
+    def frames(self):
         '''
         To build the animation, we have adopted the following strategy:
-            - We build 10 random wordclouds using words in such a way,
+            - We build wordclouds from the word counts in such a way,
             that the least frequent mords appear first, and so on.
             - We, them combine the images to form a gif.
-            
-        This function generates 10 random wordclouds using our text file.
-        '''
-        words_clean = self.get_words_string()
-        self.generateWC(part=0)
-        
-        # Find the top 350 words from out text file.
-        # Create a new string which has words listed in increasing
-        # order of their frequency.
-        # This is necessary so that we can show how new words are added
-        # to our word cloud animation.
-        words_count = Counter(words_clean.split()).most_common(350)
-        words_clean_ord = ''
-        for word in words_count:
-            words_clean_ord = (word[0]+' ')*int(word[1]) + words_clean_ord
-    
-        wc_count = 5
-        for part in range(1, wc_count):
-            # plt.figure(figsize=(9, 9))
-            
-            fig = plt.figure(figsize=(9,9))
-            fig.patch.set_facecolor('white')
-            wc = WordCloud(
-                width=1100,
-                height=1300,
-                margin=0,
-                mask=None,
-                scale=1,
-                max_words=200,
-                min_font_size=5,
-                stopwords=STOPWORDS,
-                random_state=15,
-                background_color='white',
-                max_font_size=None,
-                font_step=1,
-                mode='RGB',
-                collocations=True,
-                colormap='ocean',
-                contour_width=0,
-                contour_color='black',
-                min_word_length=3
-            )
-            # We divide the whole text file into 10 parts, and for each iteration 
-            # choose a tenth of the file to add to our wordcloud.
-            # The tenth is randomly shuffled so that the wordcloud looks 
-            # more realistic.
-            least_to_most_freq_words = words_clean_ord[:(part*len(words_clean_ord)//10) + 1].split()
-            random.shuffle(least_to_most_freq_words)
-            least_to_most_freq_words_random = ' '.join(least_to_most_freq_words)
-            wc.generate(least_to_most_freq_words_random)
-            plt.imshow(wc, interpolation='bilinear')
-            plt.axis('off')
-            plt.savefig(f'photos/WordCloud_{part}.png')
-            
-        # Adding our final animation with the whole picture.
-        self.generateWC(part+1)
-            
-    def animateWC(self):
-        '''
-        Function that completes the animation.
-        Saves the final gif into the same directory as the file.
-        '''
-        self.randomWcs()
-        
-        # Choosing all the wordcloud images.
-        images = list(glob.glob('photos/*.png'))
-        # Sorting according to the numbers added to the names, so that the wordcloud
-        # appears in order.
-        list.sort(images, key=lambda x: int(x.split('\\')[1].split('.png')[0].split('_')[-1]))
-        image_list = []
-        for image_name in images:
-            image_list.append(imageio.imread(image_name))
-        
-        # Use the following if there are many images:
-        # with imageio.get_writer('test.gif', mode='I') as writer:
-        #     for filename in images:
-        #         image = imageio.imread(filename)
-        #         writer.append_data(image)
-        imageio.mimwrite('FinalWordCloud_Anim_medium.gif', image_list, loop=2, fps=120, duration=0.3)
+
+        Yields the (options, words) of the complete cloud, then of every cloud building up
+        to it. animateWC ends the animation with the complete cloud again.
+        '''
+        yield self.complete_frame()
+        for frequencies in self.build_up_frequencies():
+            yield self.build_up_options, frequencies
+
+    def animateWC(self, gif_path, n_jobs=os.cpu_count(), window=None):
+        '''
+        param gif_path -> Path of the final gif.
+        param n_jobs -> Number of processes the frames are rendered on.
+        param window -> Maximum number of frames rendered ahead of the one being written,
+        2*n_jobs by default.
+
+        Function that completes the animation. Every frame is written into the gif as
+        soon as it and the ones before it are rendered, so only a window of frames is
+        ever held in memory.
+        '''
+        images = render_frames(self.frames(), n_jobs, window)
+        with imageio.get_writer(gif_path, mode='I', loop=2, fps=120, duration=0.3) as writer:
+            complete_image = next(images)
+            writer.append_data(complete_image)
+            for image in images:
+                writer.append_data(image)
+            # Adding our final animation with the whole picture, laid out only once.
+            writer.append_data(complete_image)
 
 ############################
 
 base_path = os.path.dirname(__file__)
-db_path = os.path.join(base_path, '../2. song_database/FinalMUSICDatabase.csv')
-df_music = pd.read_csv(db_path)
-words_string = CreateWordCloud(df_music).animateWC()
+music_db_path = stage_path(os.path.join(base_path, '../2. song_database'), 'FinalMusicDATABASE')
+frequencies_path = stage_path(base_path, 'WordFrequencies')
+gif_path = os.path.join(base_path, 'FinalWordCloud_Anim_medium.gif')
+
+def main(recount=False, n_jobs=os.cpu_count()):
+    '''
+    param recount -> Whether the words are counted again instead of read from the WordFrequencies
+    table, e.g. once the music database has changed.
+    param n_jobs -> Number of processes the frames are rendered on.
+    '''
+    if recount and table_exists(frequencies_path):
+        os.remove(existing_path(frequencies_path))
+    # Only the columns the word cloud is made of.
+    df_music = read_table(music_db_path, columns=['Title', 'Tags', 'Description'])
+    CreateWordCloud(df_music, frequencies_path).animateWC(gif_path, n_jobs)
+
+
+if __name__ == '__main__':
+    main(recount='--recount' in sys.argv[1:])
 
 ###############################################################################
@@ -0,0 +1,186 @@
+r'''
+Single entry point of the pipeline, which runs its stages as a dependency graph:
+
+    ingest -> fetch -> classify -> triage -> export -> animate
+
+    - ingest: parses the history file into the watch events and watched URLs tables.
+    - fetch: fetches the details of the watched videos, and counts their plays into the
+    listening analytics.
+    Once the plays of a run have been counted, ingest only adds the plays after them and fetch
+    only the videos it hasn't fetched before, as create_song_db_1.py --incremental does. Delete
+    _private_data/PipelineState.json to parse and fetch the whole history again.
+    - classify: builds the initial database of possible music videos.
+    - triage: labels them Y, Maybe or N, and writes the sheet of videos to check manually.
+    - export: adds the videos checked manually to the music and writes the final database.
+    - animate: creates the word cloud animation of the final database.
+
+Every stage runs only if its inputs or parameters have changed since it last ran, or if its
+outputs are missing (see module_stage_graph.py). So after downloading a new history file,
+or after checking videos manually, running the pipeline again only redoes what is affected:
+    python pipeline.py
+Name stages to only bring them (and the stages they depend on) up to date:
+    python pipeline.py classify
+Options:
+    --force STAGE   runs the stage even if it's up to date (can be repeated), --force-all runs them all.
+    --score         categorizes the videos by their MusicScore (see create_song_db_2.py).
+    --dry-run       lists the stages that would run, without running them.
+    --jobs N        classifies a large history on N processes (all the cores by default).
+Once the stages have run, the memory the table of every stage takes is printed.
+If the API quota runs out during the fetch, the pipeline stops with exit code 3 and the
+next run resumes the fetch where it stopped.
+'''
+
+import os
+import sys
+import argparse
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+for directory in ('1. modules', '2. song_database', '3. animation'):
+    sys.path.insert(1, os.path.join(base_path, directory))
+
+import create_song_db_1 as song_db_1
+import create_song_db_2 as song_db_2
+import word_cloud
+from module_stage_graph import StageGraph
+from module_pipeline_state import PipelineState
+from module_storage import stage_formats, table_paths, memory_report
+from module_fetch_video_details_2 import QuotaExhausted
+from module_identify_music_video_3 import IdentifyMusicVideo
+
+manifest_path = os.path.join(base_path, '_private_data/PipelineManifest.json')
+music_model_path = os.path.join(IdentifyMusicVideo.base_path, '../0. music_vid_identify/music_identify_data/music_model.bin')
+
+####################################
+
+def ingest():
+    # Once the plays of a run have been counted, only the plays of the history file after
+    # them are parsed and added to the tables (see create_song_db_1.update_incrementally).
+    if song_db_1.can_update_incrementally(song_db_1.watched_urls_path, song_db_1.watch_events_path):
+        song_db_1.ingest_new(PipelineState(song_db_1.state_path).last_watch_date)
+    else:
+        song_db_1.ingest()
+
+def fetch():
+    # Likewise, only the videos without details are fetched and merged into the table.
+    if song_db_1.can_update_incrementally(song_db_1.complete_history_details_path):
+        df_history_details, _ = song_db_1.fetch_new()
+    else:
+        df_history_details = song_db_1.fetch()
+    song_db_1.count_plays(df_history_details)
+
+def classify(n_jobs):
+    song_db_1.classify(n_jobs=n_jobs)
+
+def triage(scoring, thresholds):
+    song_db_2.triage(scoring=scoring, thresholds=thresholds)
+
+def export():
+    song_db_2.export()
+
+def animate():
+    # The stage only runs once the database has changed, its words are counted again.
+    word_cloud.main(recount=True)
+
+def pipeline_graph(scoring=False, n_jobs=os.cpu_count()):
+    '''
+    param scoring -> Whether the videos are triaged by their MusicScore instead of the three checks.
+    param n_jobs -> Number of processes a large history is classified on.
+
+    returns the StageGraph of the pipeline.
+    '''
+    graph = StageGraph(manifest_path)
+    # The ingest and fetch stages also read their own outputs and the PipelineState written by
+    # fetch, to only handle the newer history. They can't be inputs, the graph would have a cycle.
+    graph.add(
+        'ingest', ingest,
+        inputs=[song_db_1.history_file_path],
+        outputs=[song_db_1.watch_events_path, song_db_1.watched_urls_path],
+        )
+    graph.add(
+        'fetch', fetch,
+        inputs=[song_db_1.watched_urls_path, song_db_1.watch_events_path],
+        outputs=[song_db_1.complete_history_details_path, song_db_1.analytics_path],
+        )
+    graph.add(
+        'classify', classify,
+        inputs=[song_db_1.complete_history_details_path, music_model_path],
+        outputs=[song_db_1.music_database_path],
+        params={'n_jobs': n_jobs},
+        )
+    graph.add(
+        'triage', triage,
+        inputs=[song_db_2.init_db_path, music_model_path],
+        outputs=[song_db_2.triaged_db_path, song_db_2.manual_check_path],
+        params={
+            'scoring': scoring,
+            'thresholds': [song_db_2.music_threshold, song_db_2.not_music_threshold],
+            },
+        )
+    graph.add(
+        'export', export,
+        inputs=[song_db_2.triaged_db_path, song_db_2.manually_checked_path],
+        outputs=[song_db_2.final_music_db_path, song_db_2.search_index_path],
+        )
+    graph.add(
+        'animate', animate,
+        # The final database is read in whichever format exists (see existing_path), e.g. the
+        # csv until export first writes it. Both are inputs, so the stage runs again when the
+        # one it reads changes, and still runs after export.
+        inputs=table_paths(word_cloud.music_db_path),
+        outputs=[word_cloud.gif_path, word_cloud.frequencies_path],
+        )
+    return graph
+
+def stage_table_paths():
+    '''
+    returns a dictionary with key: stage (every stage of module_storage.stage_formats) and value:
+    the path of its table.
+    '''
+    paths = {
+        'WatchedURLs': song_db_1.watched_urls_path,
+        'WatchEvents': song_db_1.watch_events_path,
+        'WatchedURLs_allDetails': song_db_1.complete_history_details_path,
+        'InitialMusicDatabase': song_db_1.music_database_path,
+        'TriagedMusicDatabase': song_db_2.triaged_db_path,
+        'FinalMusicDATABASE': song_db_2.final_music_db_path,
+        'WordFrequencies': word_cloud.frequencies_path,
+        }
+    return {stage: paths[stage] for stage in stage_formats}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the stages of the pipeline whose inputs have changed.")
+    parser.add_argument('stages', nargs='*', help="stages to bring up to date, all of them by default")
+    parser.add_argument('--force', action='append', default=[], metavar='STAGE', help="runs the stage even if it's up to date")
+    parser.add_argument('--force-all', action='store_true', help="runs every stage")
+    parser.add_argument('--score', action='store_true', help="categorizes the videos by their MusicScore")
+    parser.add_argument('--dry-run', action='store_true', help="lists the stages that would run")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="number of processes a large history is classified on")
+    args = parser.parse_args(argv)
+
+    graph = pipeline_graph(scoring=args.score, n_jobs=args.jobs)
+    unknown = set(args.stages + args.force) - set(graph.stages)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))} (the stages are: {', '.join(graph.stages)})")
+    force = list(graph.stages) if args.force_all else args.force
+
+    if args.dry_run:
+        planned = graph.plan(args.stages, force)
+        for name, reason in planned:
+            print(f"[{name}] would run ({reason}).")
+        if not planned:
+            print("Every stage is up to date.")
+    else:
+        try:
+            graph.run(args.stages, force)
+        except QuotaExhausted:
+            # The stages that have run stay recorded, the next run resumes from the fetch.
+            sys.exit(song_db_1.quota_exit_code)
+        # How much memory the table of every stage takes, with the compact dtypes.
+        print(memory_report(stage_table_paths()))
+        print("Done!")
+
+
+if __name__ == '__main__':
+    main()
+
+###############################################################################
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules and scripts are imported by their bare names, as the scripts of the repository do.
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ('', '1. modules', '2. song_database', '3. animation'):
+    sys.path.insert(1, os.path.join(root_path, directory))
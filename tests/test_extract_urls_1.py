@@ -0,0 +1,82 @@
+import io
+import json
+import pandas as pd
+import pytest
+from bs4 import BeautifulSoup
+from module_extract_urls_1 import ParseYtHistory
+
+# A Takeout-like history, with what the format allows and Takeout rarely writes: comments
+# (one hiding an anchor, one cutting a watch time), entities, upper case tags, single and
+# missing quotes, nested tags in an anchor, a stray '<' and a cell the file ends in.
+history_html = (
+    '<!DOCTYPE html><html><head><style>body {margin: 0}</style></head><body>'
+    '<div class="outer-cell"><div class="content-cell mdl-cell">Watched&nbsp;'
+    '<a href="https://www.youtube.com/watch?v=AAAAAAAAAAA">Song &amp; Dance</a><br>'
+    '<a href="https://www.youtube.com/channel/UC1">Channel</a><br>Jan 9, 2022, 10:12:13 PM IST<br></div>'
+    '<div class="content-cell mdl-cell"><b>Products:</b><br>YouTube<br>'
+    '<a href="https://myactivity.google.com/product/youtube">here</a>.</div></div>'
+    '<!-- <a href="https://www.youtube.com/watch?v=HIDDENHIDDE">Hidden</a> -->'
+    "<DIV class='content-cell'>Watched <A HREF='https://youtu.be/BBBBBBBBBBB'>Up <b>bold</b></A><br>"
+    'Jan 10, 2022, 9:00:00<!-- cut --> AM PST<br></DIV>'
+    '<div class=content-cell>Watched <a href=https://www.youtube.com/watch?v=CCCCCCCCCCC>1 < 2</a><br>'
+    'Feb 1, 2022, 1:02:03 AM GMT+05:30'
+)
+
+
+def parsed_anchors(history, chunk_size):
+    return list(ParseYtHistory(io.StringIO(history), json_file=False).iterURLs_HTML(chunk_size))
+
+
+def test_html_anchors_match_beautifulsoup():
+    soup = BeautifulSoup(history_html, 'html.parser')
+    expected = [(a.get('href'), a.text) for a in soup.find_all('a') if a.get('href') is not None]
+    assert [(href, text) for href, text, _ in parsed_anchors(history_html, 1 << 20)] == expected
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 8, 13, 64, 257])
+def test_html_anchors_dont_depend_on_chunk_size(chunk_size):
+    assert parsed_anchors(history_html, chunk_size) == parsed_anchors(history_html, 1 << 20)
+
+
+def test_html_watch_times():
+    watch_times = {href: watch_time for href, _, watch_time in parsed_anchors(history_html, 7)}
+    assert watch_times['https://www.youtube.com/watch?v=AAAAAAAAAAA'] == 'Jan 9, 2022, 10:12:13 PM IST'
+    assert watch_times['https://youtu.be/BBBBBBBBBBB'] == 'Jan 10, 2022, 9:00:00 AM PST'
+    assert watch_times['https://www.youtube.com/watch?v=CCCCCCCCCCC'] == 'Feb 1, 2022, 1:02:03 AM GMT+05:30'
+
+
+def test_html_and_json_give_the_same_watch_dates():
+    records = [
+        {'title': 'Watched Song & Dance', 'titleUrl': 'https://www.youtube.com/watch?v=AAAAAAAAAAA', 'time': '2022-01-09T16:42:13.123Z'},
+        {'title': 'Watched Up bold', 'titleUrl': 'https://youtu.be/BBBBBBBBBBB', 'time': '2022-01-10T17:00:00Z'},
+        {'title': 'Watched 1 < 2', 'titleUrl': 'https://www.youtube.com/watch?v=CCCCCCCCCCC', 'time': '2022-01-31T19:32:03.5Z'},
+    ]
+    html_events = ParseYtHistory(history_html, json_file=False).createEventTable()
+    json_events = ParseYtHistory(json.dumps(records)).createEventTable()
+    for df in (html_events, json_events):
+        df['VideoID'] = df['VideoID'].astype(str)
+    pd.testing.assert_frame_equal(html_events, json_events)
+
+
+def test_unknown_timezones_arent_guessed():
+    dates = ParseYtHistory.parseWatchDates(pd.Series(['Jan 9, 2022, 10:12:13 PM XYZ', 'Jan 9, 2022, 4:42:13 PM UTC']))
+    assert pd.isna(dates[0])
+    assert dates[1] == pd.Timestamp('2022-01-09 16:42:13', tz='UTC')
+
+
+@pytest.mark.parametrize('link', [
+    'http://youtu.be/SA2iWivDJiE',
+    'https://youtu.be/SA2iWivDJiE?t=10',
+    'http://www.youtube.com/watch?v=_oPAwA_Udwc&feature=feedu',
+    'https://www.youtube.com/watch?feature=share&v=_oPAwA_Udwc',
+    'https://youtube.com/watch?v=_oPAwA_Udwc#t=1',
+    'http://www.youtube.com/embed/SA2iWivDJiE',
+    'http://www.youtube.com/v/SA2iWivDJiE?version=3&amp;hl=en_US',
+    'https://www.youtube.com/shorts/SA2iWivDJiE',
+    'https://www.youtube.com/channel/UC1234',
+    'https://music.youtube.com/watch?v=SA2iWivDJiE',
+    'https://myactivity.google.com/product/youtube',
+])
+def test_extracted_video_ids_match_getVideoID(link):
+    extracted = ParseYtHistory.extractVideoIDs(pd.Series([link]))[0]
+    assert (None if pd.isna(extracted) else extracted) == ParseYtHistory.getVideoID(link)
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+from module_identify_music_video_3 import IdentifyMusicVideo
+
+
+def make_history(size, seed=23):
+    '''
+    returns the details of size videos, built from the reference vocabularies so that
+    every check gets some hits.
+    '''
+    rng = np.random.default_rng(seed)
+    top_ids, top_tags, top_desc_words = IdentifyMusicVideo(None).get_cat_tag_desc()
+    tag_pool = np.array(sorted(top_tags)[:50] + [f'other tag {i}' for i in range(50)], dtype=object)
+    word_pool = np.array(sorted(top_desc_words)[:50] + [f'word{i}' for i in range(200)], dtype=object)
+    n_tags = rng.integers(0, 6, size)
+    return pd.DataFrame({
+        'VideoID': [f'{i:011d}' for i in range(size)],
+        'Title': [f'Title {i}' for i in range(size)],
+        'ChannelTitle': [f'Channel {i % 7}' for i in range(size)],
+        'CategoryID': rng.choice(['10', '24', '22', '20', '27'], size),
+        'Duration': rng.integers(30, 600, size),
+        'Tags': [list(rng.choice(tag_pool, n)) if n else None for n in n_tags],
+        'Description': [' '.join(rng.choice(word_pool, rng.integers(0, 20))) for _ in range(size)],
+        })
+
+
+def test_sharded_classification_matches_serial():
+    df_history = make_history(300)
+    df_serial = IdentifyMusicVideo(df_history.copy()).filter_music_video()
+    df_sharded = IdentifyMusicVideo(df_history.copy(), n_jobs=2, min_rows_per_job=50).filter_music_video()
+    assert 0 < len(df_serial) < len(df_history)
+    pd.testing.assert_frame_equal(df_serial, df_sharded)
+
+
+def test_tags_are_compared_in_lower_case_and_not_scored():
+    _, top_tags, _ = IdentifyMusicVideo(None).get_cat_tag_desc()
+    tag = next(tag for tag in sorted(top_tags) if tag.upper() != tag)
+    df_history = make_history(2)
+    df_history['CategoryID'] = '0'
+    df_history['Description'] = ''
+    df_history['Tags'] = [[tag.upper()], ['not a music tag']]
+    df_music = IdentifyMusicVideo(df_history).filter_music_video()
+    assert df_music['VideoID'].tolist() == [df_history['VideoID'][0]]
+    assert df_music['TagsCheck'].tolist() == [1]
+    assert 'MusicScore' not in df_music.columns
@@ -0,0 +1,58 @@
+import os
+import numpy as np
+import pandas as pd
+from module_listening_analytics import ListeningAnalytics, periods
+
+
+def expected_plays(df_events, df_details, timezone, period, dimension):
+    '''
+    returns the (PeriodStart, Key, Plays) counted straight from the events, sorted.
+    '''
+    local_dates = df_events['WatchDate'].dt.tz_convert(timezone).dt.tz_localize(None)
+    starts = {
+        'day': local_dates.dt.floor('D'),
+        'week': local_dates.dt.to_period('W-SUN').dt.start_time,
+        'month': local_dates.dt.to_period('M').dt.start_time,
+        }[period].dt.strftime('%Y-%m-%d')
+    details = df_details.set_index('VideoID').reindex(df_events['VideoID'])
+    keys = {
+        'total': pd.Series('', index=df_events.index),
+        'song': df_events['VideoID'],
+        'channel': pd.Series(details['ChannelTitle'].to_numpy(), index=df_events.index),
+        'category': pd.Series(details['CategoryID'].to_numpy(), index=df_events.index),
+        }[dimension]
+    counts = pd.DataFrame({'PeriodStart': starts, 'Key': keys}).dropna().value_counts()
+    return sorted((start, key, int(plays)) for (start, key), plays in counts.items())
+
+
+def test_rollups_add_up_the_plays_of_every_batch(tmp_path):
+    rng = np.random.default_rng(23)
+    n_events = 2000
+    video_ids = [f'{video:011d}' for video in range(40)]
+    df_details = pd.DataFrame({
+        'VideoID': video_ids[:35],
+        'Title': [f'Song {video}' for video in range(35)],
+        'ChannelTitle': [f'Channel {video % 6}' for video in range(35)],
+        'CategoryID': [str(rng.choice([10, 24, 22])) for _ in range(35)],
+        })
+    df_events = pd.DataFrame({
+        'VideoID': rng.choice(video_ids, n_events),
+        'WatchDate': pd.Timestamp('2021-12-20', tz='UTC')
+        + pd.to_timedelta(np.sort(rng.integers(0, 120 * 86400, n_events)), unit='s'),
+        })
+    timezone = 'America/New_York'
+
+    with ListeningAnalytics(os.path.join(tmp_path, 'analytics.sqlite'), timezone) as analytics:
+        # The batches overlap, as when a history is fed again: the plays already counted are skipped.
+        n_counted = sum(
+            analytics.add_events(df_events.iloc[start:end], df_details)
+            for start, end in ((0, 700), (500, 1500), (0, 1500), (1200, n_events))
+            )
+        assert n_counted == n_events
+        assert analytics.add_events(df_events, df_details) == 0
+
+        for period in periods:
+            for dimension in ('total', 'song', 'channel', 'category'):
+                df_plays = analytics.plays(period, dimension)
+                counted = sorted(zip(df_plays['PeriodStart'], df_plays['Key'], df_plays['Plays']))
+                assert counted == expected_plays(df_events, df_details, timezone, period, dimension), (period, dimension)
@@ -0,0 +1,33 @@
+import os
+from module_music_model import MusicVideoModel
+
+
+def make_model(n_tags):
+    tags = [f"tag{i}" for i in range(n_tags)]
+    return MusicVideoModel([10, 24], [90, 10], tags, range(n_tags, 0, -1), ['music', 'official'], [5, 3])
+
+
+def test_saved_model_reads_back(tmp_path):
+    path = str(tmp_path / 'music_model.bin')
+    make_model(3).save(path)
+    model = MusicVideoModel.read(path)
+    assert model.tags == ['tag0', 'tag1', 'tag2']
+    assert model.tag_counts.tolist() == [3, 2, 1]
+    assert model.vocabularies() == (frozenset([10, 24]), frozenset(model.tags), frozenset(['music', 'official']))
+    model.close()
+
+
+def test_rewritten_model_replaces_the_loaded_one(tmp_path):
+    path = str(tmp_path / 'music_model.bin')
+    make_model(3).save(path)
+    old_model = MusicVideoModel.load(path)
+    assert MusicVideoModel.load(path) is old_model
+    old_mapped = old_model.mapped
+
+    make_model(5).save(path)
+    # The same size and modification time would look like the same file.
+    os.utime(path, ns=(1, 1))
+    new_model = MusicVideoModel.load(path)
+    assert len(new_model.tags) == 5
+    assert old_mapped.closed
+    assert MusicVideoModel.loaded_models[os.path.abspath(path)][1] is new_model
@@ -0,0 +1,6 @@
+import pipeline
+from module_storage import stage_formats
+
+
+def test_memory_report_covers_every_stage():
+    assert list(pipeline.stage_table_paths()) == list(stage_formats)
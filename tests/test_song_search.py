@@ -0,0 +1,26 @@
+import os
+import pytest
+from module_identify_music_video_3 import IdentifyMusicVideo
+from module_song_search import SongSearchIndex
+from test_identify_music_video_3 import make_history
+
+
+def test_songs_are_found_by_their_channel(tmp_path):
+    df_history = make_history(300)
+    df_history['ChannelTitle'] = 'Ordinary Channel'
+    df_history.loc[7, 'ChannelTitle'] = 'Vermilion Records'
+    df_history.loc[7, 'CategoryID'] = '10'
+    df_music = IdentifyMusicVideo(df_history).filter_music_video()
+
+    with SongSearchIndex(os.path.join(tmp_path, 'index.sqlite')) as index:
+        index.add_songs(df_music)
+        results = index.search('vermilion')
+    assert [(result.VideoID, result.ChannelTitle) for result in results] == [(df_history['VideoID'][7], 'Vermilion Records')]
+
+
+def test_songs_without_a_weighted_field_are_refused(tmp_path):
+    df_music = IdentifyMusicVideo(make_history(100)).filter_music_video().drop(columns=['ChannelTitle'])
+    with SongSearchIndex(os.path.join(tmp_path, 'index.sqlite')) as index:
+        with pytest.raises(ValueError, match='ChannelTitle'):
+            index.add_songs(df_music)
+        assert len(index) == 0
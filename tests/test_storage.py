@@ -0,0 +1,44 @@
+import os
+import pandas as pd
+from module_storage import as_list, read_table, write_table, append_table, memory_report
+
+
+def watch_events(video_ids, first_day):
+    return pd.DataFrame({
+        'VideoID': pd.Categorical(video_ids),
+        'WatchDate': pd.date_range(first_day, periods=len(video_ids), freq='D', tz='UTC'),
+        })
+
+
+def test_appending_writes_parts_read_back_as_one_table(tmp_path):
+    path = os.path.join(tmp_path, 'WatchEvents.parquet')
+    batches = [watch_events(['a', 'b'], '2020-01-01'), watch_events(['c', 'a', 'c'], '2020-01-03'), watch_events(['d'], '2020-01-06')]
+    write_table(batches[0], path)
+    for batch in batches[1:]:
+        append_table(batch, path)
+
+    assert sorted(os.listdir(path)) == ['part-00000.parquet', 'part-00001.parquet', 'part-00002.parquet']
+    df = read_table(path)
+    expected = pd.concat(batches, ignore_index=True)
+    assert df['VideoID'].astype(str).tolist() == expected['VideoID'].astype(str).tolist()
+    assert df['WatchDate'].tolist() == expected['WatchDate'].tolist()
+
+    # Writing the table again replaces the parts with a single file.
+    write_table(batches[0], path)
+    assert os.path.isfile(path)
+    assert len(read_table(path)) == 2
+
+
+def test_as_list_keeps_text_that_looks_like_a_list():
+    assert as_list("['Official', 'Video']") == ['Official', 'Video']
+    assert as_list('[Official Video]') == ['[Official Video]']
+    assert as_list('[') == ['[']
+    assert as_list(None) == []
+
+
+def test_memory_report_reads_the_tables_given_by_path(tmp_path):
+    path = os.path.join(tmp_path, 'WatchEvents.parquet')
+    write_table(watch_events(['a', 'b', 'a'], '2020-01-01'), path)
+    report = memory_report({'WatchEvents': path, 'WordFrequencies': os.path.join(tmp_path, 'WordFrequencies.parquet')})
+    assert report.splitlines()[1].startswith('  WatchEvents: 3 rows, ')
+    assert report.splitlines()[2] == '  WordFrequencies: not written yet'
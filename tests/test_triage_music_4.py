@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+from types import SimpleNamespace
+from module_triage_music_4 import triage_music
+
+
+def expected_label(row):
+    '''
+    returns the label the original row by row triage gave to a video.
+    '''
+    n_checks = row['CategoryCheck'] + row['TagsCheck'] + row['DescriptionCheck']
+    if int(row['CategoryID']) == 10 or n_checks == 3:
+        return 'Y'
+    if n_checks == 0:
+        return 'N'
+    return 'Maybe'
+
+
+def test_triage_partitions_the_videos_by_their_checks():
+    rng = np.random.default_rng(23)
+    size = 500
+    df = pd.DataFrame({
+        'VideoID': [f'{i:011d}' for i in range(size)],
+        'CategoryID': rng.choice(['10', '24', '22', '20'], size),
+        'CategoryCheck': rng.integers(0, 2, size),
+        'TagsCheck': rng.integers(0, 2, size),
+        'DescriptionCheck': rng.integers(0, 2, size),
+        }, index=rng.permutation(size))
+    df_labelled, music, maybe, not_music = triage_music(df)
+
+    expected = df.apply(expected_label, axis=1)
+    assert df_labelled['Is_Music'].astype(str).tolist() == expected.tolist()
+    for group, label in ((music, 'Y'), (maybe, 'Maybe'), (not_music, 'N')):
+        assert len(group) > 0
+        assert group.index.tolist() == expected.index[expected == label].tolist()
+        assert (group['Is_Music'] == label).all()
+    assert len(music) + len(maybe) + len(not_music) == size
+
+
+def test_triage_by_score_uses_the_thresholds():
+    df = pd.DataFrame({'MusicScore': [0.9, 0.5, 0.1, 0.6, 0.2]})
+    scorer = SimpleNamespace(music_threshold=0.6, not_music_threshold=0.2)
+    _, music, maybe, not_music = triage_music(df, scorer)
+    assert music.index.tolist() == [0, 3]
+    assert maybe.index.tolist() == [1, 4]
+    assert not_music.index.tolist() == [2]
@@ -0,0 +1,28 @@
+import imageio
+import numpy as np
+import pandas as pd
+import word_cloud
+from word_cloud import CreateWordCloud
+
+
+def test_animation_lays_out_the_complete_cloud_once(tmp_path, monkeypatch):
+    rendered = []
+
+    def render_frame(frame):
+        # A plain image per frame, its shade telling the frames apart.
+        rendered.append(frame)
+        return np.full((8, 8, 3), 40 * len(rendered), dtype='uint8')
+
+    monkeypatch.setattr(word_cloud, 'render_frame', render_frame)
+    df_music = pd.DataFrame({
+        'Title': ['Midnight melody', 'Summer rhythm'],
+        'Tags': [['melody', 'rhythm'], ['summer']],
+        'Description': ['a melody for summer nights', 'rhythm and melody'],
+        })
+    gif_path = str(tmp_path / 'animation.gif')
+    CreateWordCloud(df_music, str(tmp_path / 'WordFrequencies.parquet')).animateWC(gif_path, n_jobs=1)
+
+    shades = [int(image[0, 0, 0]) for image in imageio.mimread(gif_path)]
+    assert len(rendered) == 5
+    assert rendered[0][0] is CreateWordCloud.complete_options
+    assert shades == [40, 80, 120, 160, 200, 40]